@@ -113,6 +113,24 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "recommendations": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "recommendations",
+        "TIMEOUT": int(os.getenv('RECOMMENDATION_CACHE_TTL') or 600),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv('RECOMMENDATION_CACHE_SIZE') or 10000),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -243,4 +261,37 @@ GOOGLE_FRONTEND_REDIRECT_URL = os.getenv('GOOGLE_FRONTEND_REDIRECT_URL')
 EMAIL_API_KEY = os.getenv('EMAIL_API_KEY')
 
 GENERATE_VIDEO_URL = os.getenv('GENERATE_VIDEO_URL')
-GENERATE_VIDEO_SECRET = os.getenv('GENERATE_VIDEO_SECRET')
\ No newline at end of file
+GENERATE_VIDEO_SECRET = os.getenv('GENERATE_VIDEO_SECRET')
+
+# Recommender
+RECOMMENDER_PRELOAD = bool(os.getenv('RECOMMENDER_PRELOAD'))
+# Seconds between checks for a new model version (0 disables hot reload),
+# and how many published versions to keep on disk
+MODEL_RELOAD_INTERVAL = float(os.getenv('MODEL_RELOAD_INTERVAL') or 30)
+MODEL_REGISTRY_KEEP = int(os.getenv('MODEL_REGISTRY_KEEP') or 3)
+# int8 dynamic quantization of the NCF layers and a float16 embedding table (CPU only)
+RECOMMENDER_QUANTIZE = bool(os.getenv('RECOMMENDER_QUANTIZE'))
+# Every member is scored on the full catalog by default. A positive pool first shortlists that many
+# movies by the group's mean embedding: faster for big groups, but only an approximation of the
+# least_misery and most_pleasure rankings, since the model is nonlinear.
+GROUP_CANDIDATE_POOL = int(os.getenv('GROUP_CANDIDATE_POOL') or 0)
+# Seconds a group's recommendations stay cached
+GROUP_RECOMMENDATION_CACHE_TTL = int(os.getenv('GROUP_RECOMMENDATION_CACHE_TTL') or 60)
+# Data-parallel training processes for train_model (1 trains in this process)
+TRAIN_WORKERS = int(os.getenv('TRAIN_WORKERS') or 1)
+# Neighbours precomputed per movie for the similar movies endpoint
+SIMILAR_MOVIES_K = int(os.getenv('SIMILAR_MOVIES_K') or 50)
+# Popular movies served to cold-start users, and seconds between refreshes (0 disables)
+FALLBACK_POOL_SIZE = int(os.getenv('FALLBACK_POOL_SIZE') or 50)
+FALLBACK_POOL_REFRESH_INTERVAL = float(os.getenv('FALLBACK_POOL_REFRESH_INTERVAL') or 3600)
+# Seconds between checks of the catalog version; a worker rebuilds its content recommender and
+# fallback pools once an import or sync changed the catalog (0 disables)
+CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL') or 60)
+# Opt-in micro-batching of concurrent requests; a batch size of 1 (the default) scores every request
+# directly on the inference executor
+RECOMMENDER_BATCH_SIZE = int(os.getenv('RECOMMENDER_BATCH_SIZE') or 1)
+RECOMMENDER_BATCH_WAIT_MS = float(os.getenv('RECOMMENDER_BATCH_WAIT_MS') or 5)
+# Threads scoring requests for the async views, and torch threads each of them may use.
+# By default inference gets at most half of the cores, the rest serve the event loop.
+RECOMMENDER_WORKERS = int(os.getenv('RECOMMENDER_WORKERS') or 2)
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS') or max(1, (os.cpu_count() or 1) // (2 * RECOMMENDER_WORKERS)))
\ No newline at end of file
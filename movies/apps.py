@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MoviesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "movies"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Load the recommender at startup instead of on the first request
+        if settings.RECOMMENDER_PRELOAD:
+            from .ml_model import get_recommender
+            get_recommender()
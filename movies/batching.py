@@ -0,0 +1,136 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import torch
+from django.conf import settings
+
+from .ml_model import device, get_recommender
+
+
+class _Request:
+    def __init__(self, user_emb, rated_movie_ids, top_n):
+        self.user_emb = user_emb
+        self.rated_movie_ids = rated_movie_ids
+        self.top_n = top_n
+        self.future = Future()
+
+
+class BatchScheduler:
+    """
+    Micro-batching inference server. Callers queue their user embedding and a
+    single worker thread scores up to max_batch_size users per tick as one
+    (users x movies) pass, then hands every caller its own top-k. A tick
+    starts as soon as the batch is full or max_wait_ms after its first request.
+
+    Opt-in (RECOMMENDER_BATCH_SIZE > 1): on CPU the NCF pass is compute bound
+    and benchmark_batching shows no consistent gain over scoring every
+    request on the inference executor.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait_ms=5, recommender_getter=get_recommender):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._get_recommender = recommender_getter
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, user_emb, rated_movie_ids, top_n=10):
+        """
+        Queue a user embedding for scoring. Returns a Future with the top_n movieIds.
+        """
+        self._ensure_worker()
+        request = _Request(np.asarray(user_emb, dtype=np.float32), list(rated_movie_ids), top_n)
+        self._queue.put(request)
+        return request.future
+
+    def recommend(self, user_emb, rated_movie_ids, top_n=10):
+        return self.submit(user_emb, rated_movie_ids, top_n).result()
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="recommender-batcher", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Requests whose caller went away are dropped; the rest can no longer be cancelled
+        return [request for request in batch if request.future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        torch.set_num_threads(settings.TORCH_NUM_THREADS)
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _process(self, batch):
+        recommender = self._get_recommender()
+        user_embs = torch.from_numpy(np.stack([r.user_emb for r in batch])).to(device)
+        scores = recommender.score_batch(user_embs)
+        exclude_rows = [recommender.rows_for(r.rated_movie_ids)[0] for r in batch]
+        top = recommender.top_k_batch(scores, exclude_rows, max(r.top_n for r in batch))
+        for request, movie_ids in zip(batch, top):
+            request.future.set_result(movie_ids[:request.top_n])
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_batch_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BatchScheduler(settings.RECOMMENDER_BATCH_SIZE, settings.RECOMMENDER_BATCH_WAIT_MS)
+    return _scheduler
+
+
+# ------------------ Async entry points ------------------
+# CPU-bound torch work runs on this bounded pool, never on the event loop.
+# Django does not manage these threads' database connections: no ORM calls here.
+# Each thread keeps its torch intra-op threads within the cores left over by the
+# ASGI server; training and other processes keep torch's default.
+_inference_executor = ThreadPoolExecutor(max_workers=settings.RECOMMENDER_WORKERS,
+                                         thread_name_prefix="recommender",
+                                         initializer=torch.set_num_threads,
+                                         initargs=(settings.TORCH_NUM_THREADS,))
+
+
+async def run_inference(fn, *args):
+    """
+    Run fn(*args) on the inference executor and await its result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_inference_executor, fn, *args)
+
+
+async def arecommend_for_embedding(user_emb, rated_movie_ids, top_n=10):
+    """
+    Score a user embedding on the inference executor, or through the batch
+    scheduler when batching is enabled (RECOMMENDER_BATCH_SIZE > 1).
+    """
+    if settings.RECOMMENDER_BATCH_SIZE <= 1:
+        return await run_inference(get_recommender().recommend_for_embedding, user_emb, list(rated_movie_ids), top_n)
+    return await asyncio.wrap_future(get_batch_scheduler().submit(user_emb, rated_movie_ids, top_n))
@@ -0,0 +1,218 @@
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from .batching import BatchScheduler
+from .content_recommender import ContentRecommender
+from .ml_model import Recommender
+from .ml_model_train import NCF, MovieRatingDataset, ShardedBatchLoader, fit_ratings, movie_vocabulary
+from .ratings_store import RatingsStore
+
+
+def synthetic_recommender(num_movies=45000, embedding_dim=50, seed=0, quantize=False):
+    """
+    Randomly initialised recommender of realistic size, for benchmarks.
+    """
+    torch.manual_seed(seed)
+    model = NCF(num_movies, embedding_dim)
+    model.eval()
+    return Recommender(model, np.arange(1, num_movies + 1), version="synthetic", quantize=quantize)
+
+
+
+def _run_concurrently(fn, requests, concurrency):
+    """
+    Call fn(*request) for every request from `concurrency` threads.
+    Returns the wall time in seconds.
+    """
+    pending = list(requests)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                request = pending.pop()
+            fn(*request)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def benchmark_batching(num_movies=45000, num_requests=64, concurrency=16,
+                       max_batch_size=16, max_wait_ms=5, top_n=50):
+    """
+    Throughput of single-request scoring against the micro-batching scheduler
+    for num_requests concurrent recommendation calls.
+    """
+    recommender = synthetic_recommender(num_movies)
+    rng = np.random.default_rng(0)
+    requests = [
+        (rng.standard_normal(recommender.model.movie_embedding.embedding_dim).astype(np.float32),
+         rng.choice(recommender.movie_ids, 20, replace=False), top_n)
+        for _ in range(num_requests)
+    ]
+
+    # Warm up both paths
+    recommender.recommend_for_embedding(*requests[0])
+    scheduler = BatchScheduler(max_batch_size, max_wait_ms, recommender_getter=lambda: recommender)
+    scheduler.recommend(*requests[0])
+
+    single = _run_concurrently(recommender.recommend_for_embedding, requests, concurrency)
+    batched = _run_concurrently(scheduler.recommend, requests, concurrency)
+
+    results = {
+        "num_movies": num_movies,
+        "num_requests": num_requests,
+        "concurrency": concurrency,
+        "max_batch_size": max_batch_size,
+        "single_requests_per_sec": num_requests / single,
+        "batched_requests_per_sec": num_requests / batched,
+    }
+    print(f"🏁 single: {results['single_requests_per_sec']:.1f} req/s, "
+          f"batched: {results['batched_requests_per_sec']:.1f} req/s")
+    return results
+
+
+def synthetic_content_recommender(num_movies=45000, seed=0):
+    """
+    Content recommender over a random catalog with MovieLens/TMDB-like
+    feature counts: 20 genres, 20k keywords, 10k companies, 80 languages.
+    """
+    rng = np.random.default_rng(seed)
+    movie_pks = np.arange(1, num_movies + 1)
+
+    def links(per_movie, vocabulary):
+        counts = rng.poisson(per_movie, num_movies)
+        pks = np.repeat(movie_pks, counts)
+        # Zipf-like popularity, as real keywords and companies have
+        related = np.minimum(rng.zipf(1.3, len(pks)), vocabulary)
+        return pks, related
+
+    return ContentRecommender.from_pairs(movie_pks, {
+        "genres": links(2.5, 20),
+        "keywords": links(8, 20000),
+        "production_companies": links(3, 10000),
+        "spoken_languages": links(1.5, 80),
+    })
+
+
+def benchmark_content_recommender(num_movies=45000, num_requests=200, top_n=50):
+    """
+    Latency of content-based recommendations for users with one or two
+    ratings and for stated genre preferences, at full catalog size.
+    """
+    start = time.perf_counter()
+    recommender = synthetic_content_recommender(num_movies)
+    build = time.perf_counter() - start
+    rng = np.random.default_rng(1)
+
+    def latency(requests):
+        timings = []
+        for ratings, genres in requests:
+            start = time.perf_counter()
+            recommender.recommend(ratings, genres, top_n)
+            timings.append(time.perf_counter() - start)
+        return np.percentile(timings, [50, 99]) * 1000
+
+    rated = [
+        ({int(pk): float(rng.integers(1, 6)) for pk in rng.choice(recommender.movie_pks, rng.integers(1, 3))}, ())
+        for _ in range(num_requests)
+    ]
+    genres = [(None, tuple(rng.choice(np.arange(1, 21), 2, replace=False).tolist())) for _ in range(num_requests)]
+    latency(rated[:10])  # warm up
+
+    results = {
+        "num_movies": num_movies,
+        "num_features": len(recommender.columns),
+        "nnz": recommender.matrix.nnz,
+        "build_seconds": build,
+        "ratings_p50_ms": 0.0, "ratings_p99_ms": 0.0,
+        "genres_p50_ms": 0.0, "genres_p99_ms": 0.0,
+    }
+    results["ratings_p50_ms"], results["ratings_p99_ms"] = map(float, latency(rated))
+    results["genres_p50_ms"], results["genres_p99_ms"] = map(float, latency(genres))
+    print(f"🏁 content recommender ({num_movies} movies, {results['num_features']} features): "
+          f"ratings p50 {results['ratings_p50_ms']:.2f} ms / p99 {results['ratings_p99_ms']:.2f} ms, "
+          f"genres p50 {results['genres_p50_ms']:.2f} ms / p99 {results['genres_p99_ms']:.2f} ms")
+    return results
+
+
+def benchmark_training_input(num_ratings=5_000_000, num_movies=45000, batch_size=256,
+                             shard_size=1_000_000, dataloader_batches=500):
+    """
+    Samples/sec of the training input pipeline: DataLoader over
+    MovieRatingDataset against ShardedBatchLoader over memory-mapped columns,
+    and the peak memory the sharded loader allocates over one epoch.
+    """
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        movie_path, rating_path = os.path.join(tmp, "movieId.npy"), os.path.join(tmp, "rating.npy")
+        np.save(movie_path, rng.integers(1, num_movies + 1, num_ratings, dtype=np.int32))
+        np.save(rating_path, (rng.integers(1, 11, num_ratings) / 2).astype(np.float32))
+        movies, ratings = np.load(movie_path, mmap_mode="r"), np.load(rating_path, mmap_mode="r")
+        movie_ids = movie_vocabulary(movies)
+
+        dataset = MovieRatingDataset({"movie_idx": np.searchsorted(movie_ids, movies), "rating": ratings})
+        start = time.perf_counter()
+        for i, _ in enumerate(DataLoader(dataset, batch_size=batch_size, shuffle=True)):
+            if i + 1 == dataloader_batches:
+                break
+        dataloader_rate = dataloader_batches * batch_size / (time.perf_counter() - start)
+        del dataset
+
+        loader = ShardedBatchLoader(movies, ratings, movie_ids, batch_size, shard_size)
+        tracemalloc.start()
+        start = time.perf_counter()
+        seen = sum(len(batch_ratings) for _, batch_ratings in loader)
+        sharded_rate = seen / (time.perf_counter() - start)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results = {
+        "num_ratings": num_ratings,
+        "dataloader_samples_per_sec": dataloader_rate,
+        "sharded_samples_per_sec": sharded_rate,
+        "sharded_peak_mb": peak / 2**20,
+    }
+    print(f"🏁 DataLoader: {dataloader_rate:,.0f} samples/s, sharded: {sharded_rate:,.0f} samples/s "
+          f"(peak {results['sharded_peak_mb']:.0f} MB for {num_ratings:,} ratings)")
+    return results
+
+
+def benchmark_distributed_training(process_counts=(1, 2, 4, 8), num_ratings=1_000_000, num_movies=45000,
+                                   epochs=1, batch_size=256):
+    """
+    Training throughput of fit_ratings at several data-parallel process counts.
+    Each process uses batch_size, so the effective batch grows with the count.
+    """
+    rng = np.random.default_rng(0)
+    results = {"num_ratings": num_ratings, "cpu_count": os.cpu_count(), "samples_per_sec": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = RatingsStore(os.path.join(tmp, "ratings"))
+        store.write_segment({
+            "userId": rng.integers(1, 100000, num_ratings),
+            "movieId": rng.integers(1, num_movies + 1, num_ratings),
+            "rating": rng.integers(1, 11, num_ratings) / 2,
+            "timestamp": np.zeros(num_ratings),
+        })
+        movie_ids = movie_vocabulary(store.load()["movieId"])
+        for workers in process_counts:
+            start = time.perf_counter()
+            fit_ratings(store, movie_ids, epochs=epochs, batch_size=batch_size, workers=workers)
+            rate = num_ratings * epochs / (time.perf_counter() - start)
+            results["samples_per_sec"][workers] = rate
+            print(f"🏁 {workers} process(es): {rate:,.0f} samples/s")
+    return results
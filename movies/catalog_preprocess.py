@@ -0,0 +1,230 @@
+"""
+Preprocessing of the TMDB and MovieLens source CSVs into one typed artifact.
+
+    movielens_dataset/catalog/
+        catalog.json    <- sizes and mtimes of the sources it was built from
+        catalog.pkl     <- {"movies": DataFrame, "<m2m field>": DataFrame}
+
+tmdbmovies.csv is read in chunks with explicit dtypes and the chunks are
+parsed by a process pool. "movies" holds one typed row per movie common to
+both datasets; every M2M field is a long (tmdb_id, name) table. The artifact
+is rebuilt only when a source file changed, so repeated imports skip parsing.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+
+import pandas as pd
+from django.conf import settings
+
+DATASET_DIR = os.path.join(settings.BASE_DIR, "movielens_dataset")
+CATALOG_META = "catalog.json"
+CATALOG_FILE = "catalog.pkl"
+SOURCES = ("tmdbmovies.csv", "movies.csv", "links.csv")
+CHUNK_ROWS = 50000
+
+DEFAULT_POSTER = ""
+DEFAULT_BACKDROP = ""
+
+# Comma-separated TMDB columns filling the Movie M2M fields
+M2M_COLUMNS = ("genres", "keywords", "production_companies", "production_countries", "spoken_languages")
+TMDB_DTYPES = {
+    "id": "int64",
+    "title": "string",
+    "original_title": "string",
+    "overview": "string",
+    "tagline": "string",
+    "status": "string",
+    "release_date": "string",
+    "runtime": "float64",
+    "revenue": "float64",
+    "budget": "float64",
+    "adult": "string",
+    "vote_average": "float64",
+    "vote_count": "float64",
+    "popularity": "float64",
+    "original_language": "string",
+    "poster_path": "string",
+    "backdrop_path": "string",
+    "homepage": "string",
+    **{column: "string" for column in M2M_COLUMNS},
+}
+LINKS_DTYPES = {"movieId": "int64", "imdbId": "Int64", "tmdbId": "Int64"}
+
+
+# ------------------ Parsing (worker processes) ------------------
+_worker_links = None
+
+
+def _read_links(dataset_dir):
+    """
+    MovieLens links of the movies in movies.csv.
+    """
+    ml_movies = pd.read_csv(os.path.join(dataset_dir, "movies.csv"), usecols=["movieId"], dtype={"movieId": "int64"})
+    links = pd.read_csv(os.path.join(dataset_dir, "links.csv"), usecols=list(LINKS_DTYPES), dtype=LINKS_DTYPES)
+    links = links[links["movieId"].isin(ml_movies["movieId"]) & links["tmdbId"].notna()]
+    return links.astype({"tmdbId": "int64"})
+
+
+def _init_worker(links):
+    global _worker_links
+    _worker_links = links
+
+
+def _source_hashes(movies, m2m):
+    """
+    SHA-1 of every movie's field values and M2M names, to find changed rows on sync.
+    """
+    names = {}
+    for field, items in m2m.items():
+        for row, name in zip(items["row"].tolist(), items["name"].tolist()):
+            names.setdefault(row, {}).setdefault(field, []).append(name)
+    fields = movies.drop(columns="row")
+    fields = fields.astype(object).where(fields.notna(), None)
+    return [
+        hashlib.sha1(json.dumps([values, names.get(row, {})], sort_keys=True, default=str).encode()).hexdigest()
+        for row, values in zip(movies["row"].tolist(), fields.itertuples(index=False, name=None))
+    ]
+
+
+def _parse_tmdb_chunk(chunk):
+    """
+    Typed Movie fields of the TMDB rows of a chunk that have a MovieLens link,
+    and a long (row, name) table per M2M column. row is the row's position in
+    the source file.
+    """
+    links = _worker_links
+    # Most TMDB rows have no MovieLens link; they are dropped before parsing
+    chunk = chunk[chunk["id"].isin(links["tmdbId"])]
+
+    def column(name):
+        return chunk[name] if name in chunk else pd.Series(None, index=chunk.index, dtype=TMDB_DTYPES[name])
+
+    def integer(name):
+        return column(name).round().astype("Int64")
+
+    def image_url(name, default):
+        return ("https://image.tmdb.org/t/p/original" + column(name)).fillna(default)
+
+    movies = pd.DataFrame({
+        "row": chunk.index.to_numpy(),
+        "tmdb_id": chunk["id"].astype("int64"),
+        "title": column("title"),
+        "original_title": column("original_title"),
+        "overview": column("overview"),
+        "tagline": column("tagline"),
+        "status": column("status"),
+        "release_date": pd.to_datetime(column("release_date"), format="%Y-%m-%d", errors="coerce"),
+        "runtime": integer("runtime"),
+        "revenue": integer("revenue"),
+        "budget": integer("budget"),
+        "adult": column("adult").str.lower().isin(["true", "1"]),
+        "vote_average": column("vote_average"),
+        "vote_count": integer("vote_count"),
+        "popularity": column("popularity"),
+        "original_language": column("original_language"),
+        "poster_path": image_url("poster_path", DEFAULT_POSTER),
+        "backdrop_path": image_url("backdrop_path", DEFAULT_BACKDROP),
+        "homepage": column("homepage"),
+    })
+    movies = movies.merge(links, left_on="tmdb_id", right_on="tmdbId", how="inner")
+    imdb_id = "tt" + movies["imdbId"].astype("string").str.zfill(7)
+    movies = movies.assign(movieId=movies["movieId"].astype("Int64"), imdb_id=imdb_id)
+    movies = movies.drop(columns=["tmdbId", "imdbId"])
+
+    m2m = {}
+    for name in M2M_COLUMNS:
+        names = column(name).str.split(",").explode().str.strip()
+        names = names[names.notna() & (names != "")]
+        items = pd.DataFrame({"row": names.index.to_numpy(), "name": names.to_numpy()})
+        m2m[name] = items.drop_duplicates().astype({"row": "int64", "name": "string"})
+    movies["source_hash"] = _source_hashes(movies, m2m)
+    return movies, m2m
+
+
+# ------------------ Joining ------------------
+def _join(parts):
+    """
+    The catalog frames from the parsed chunks, one movie per tmdb id.
+    """
+    movies = pd.concat([movies for movies, _ in parts], ignore_index=True)
+    print(f"✅ Found {len(movies)} movies common to both TMDB and MovieLens")
+    # A tmdb id appears once in Movie; like update_or_create did, the last row wins
+    movies = movies.sort_values("row", kind="stable").drop_duplicates(subset="tmdb_id", keep="last")
+    # Rows the per-row import used to skip with an error
+    skipped = movies["title"].isna()
+    if skipped.any():
+        print(f"❌ Skipping {skipped.sum()} movies without a title")
+    movies = movies[~skipped].reset_index(drop=True)
+
+    kept = movies.set_index("row")["tmdb_id"]
+    catalog = {"movies": movies.drop(columns="row")}
+    for name in M2M_COLUMNS:
+        items = pd.concat([m2m[name] for _, m2m in parts], ignore_index=True)
+        items = items[items["row"].isin(kept.index)]
+        catalog[name] = pd.DataFrame({
+            "tmdb_id": items["row"].map(kept).to_numpy(),
+            "name": items["name"].to_numpy(),
+        }).drop_duplicates(ignore_index=True)
+    return catalog
+
+
+def build_catalog(workers=None, chunksize=CHUNK_ROWS, dataset_dir=None):
+    """
+    Parse the source CSVs into the catalog frames, one TMDB chunk per task.
+    """
+    dataset_dir = dataset_dir or DATASET_DIR
+    workers = workers or os.cpu_count() or 1
+    links = _read_links(dataset_dir)
+    print(f"📥 Parsing {SOURCES[0]} in chunks of {chunksize} rows with {workers} workers...")
+    chunks = pd.read_csv(os.path.join(dataset_dir, SOURCES[0]), dtype=TMDB_DTYPES, chunksize=chunksize,
+                         usecols=lambda name: name in TMDB_DTYPES)
+    if workers == 1:
+        _init_worker(links)
+        parts = [_parse_tmdb_chunk(chunk) for chunk in chunks]
+    else:
+        # spawn, as for precompute_recommendations; imap keeps the chunk order
+        with multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(links,)) as pool:
+            parts = list(pool.imap(_parse_tmdb_chunk, chunks))
+    return _join(parts)
+
+
+# ------------------ Cached artifact ------------------
+def _source_stats(dataset_dir):
+    stats = {}
+    for name in SOURCES:
+        stat = os.stat(os.path.join(dataset_dir, name))
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def load_catalog(workers=None, chunksize=CHUNK_ROWS, rebuild=False, dataset_dir=None):
+    """
+    The catalog frames, read from the cached artifact when it was built from
+    the current source files and rebuilt otherwise.
+    """
+    dataset_dir = dataset_dir or DATASET_DIR
+    catalog_dir = os.path.join(dataset_dir, "catalog")
+    stats = _source_stats(dataset_dir)
+    try:
+        with open(os.path.join(catalog_dir, CATALOG_META), encoding="utf-8") as f:
+            fresh = json.load(f)["sources"] == stats
+    except FileNotFoundError:
+        fresh = False
+    if fresh and not rebuild:
+        print("📂 Loading the preprocessed catalog...")
+        return pd.read_pickle(os.path.join(catalog_dir, CATALOG_FILE))
+
+    catalog = build_catalog(workers, chunksize, dataset_dir)
+    os.makedirs(catalog_dir, exist_ok=True)
+    tmp_path = os.path.join(catalog_dir, f".{CATALOG_FILE}.tmp")
+    pd.to_pickle(catalog, tmp_path)
+    os.replace(tmp_path, os.path.join(catalog_dir, CATALOG_FILE))
+    # Written last, so a crash mid-write leaves the artifact stale, never wrong
+    tmp_path = os.path.join(catalog_dir, f".{CATALOG_META}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"sources": stats, "movies": len(catalog["movies"])}, f)
+    os.replace(tmp_path, os.path.join(catalog_dir, CATALOG_META))
+    print(f"💾 Preprocessed catalog saved to {catalog_dir}")
+    return catalog
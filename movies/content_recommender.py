@@ -0,0 +1,173 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from scipy import sparse
+
+from .models import Movie
+
+# Movie M2M fields the item vectors are built from
+CONTENT_FIELDS = ("genres", "keywords", "production_companies", "spoken_languages")
+
+
+class ContentRecommender:
+    """
+    Content-based recommender for users the NCF model cannot serve: cold-start
+    users and movies that are not in the MovieLens ratings. Every movie is an
+    L2-normalised TF-IDF row over its genres, keywords, production companies
+    and spoken languages, kept as a CSR matrix. A user is scored with one
+    sparse matvec of the catalog against their taste profile.
+    """
+
+    def __init__(self, matrix, movie_pks, columns):
+        self.matrix = matrix.tocsr()
+        # movie_pks[i] is the Movie primary key of row i
+        self.movie_pks = np.asarray(movie_pks, dtype=np.int64)
+        self._sorter = np.argsort(self.movie_pks, kind="stable")
+        # (field, related id) -> column
+        self.columns = columns
+        # Movie.objects.version() of the catalog the matrix was built from
+        self.catalog_version = None
+
+    @classmethod
+    def from_pairs(cls, movie_pks, pairs):
+        """
+        Build the TF-IDF matrix from {field: (movie pks, related ids)} pairs.
+        """
+        movie_pks = np.asarray(movie_pks, dtype=np.int64)
+        sorter = np.argsort(movie_pks, kind="stable")
+        rows, cols, columns = [], [], {}
+        for field, (pks, related_ids) in pairs.items():
+            pks = np.asarray(pks, dtype=np.int64)
+            related_ids = np.asarray(related_ids, dtype=np.int64)
+            uniques, col = np.unique(related_ids, return_inverse=True)
+            offset = len(columns)
+            columns.update({(field, int(r)): offset + i for i, r in enumerate(uniques)})
+            rows.append(sorter[np.searchsorted(movie_pks, pks, sorter=sorter)])
+            cols.append(offset + col)
+
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+        shape = (len(movie_pks), len(columns))
+        tf = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+        tf.data[:] = 1  # duplicate pairs count once
+
+        # Smoothed idf, as in sklearn's TfidfTransformer
+        df = np.bincount(tf.indices, minlength=shape[1])
+        idf = (np.log((1 + shape[0]) / (1 + df)) + 1).astype(np.float32)
+        matrix = tf @ sparse.diags(idf)
+        norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms).astype(np.float32) @ matrix
+        return cls(matrix, movie_pks, columns)
+
+    @classmethod
+    def from_database(cls):
+        print("📂 Building content recommender from the catalog...")
+        # Read first, so a sync committing mid-build triggers another rebuild
+        catalog_version = Movie.objects.version()
+        movie_pks = list(Movie.objects.active().values_list("pk", flat=True))
+        pairs = {}
+        for field in CONTENT_FIELDS:
+            m2m = getattr(Movie, field).field
+            links = m2m.remote_field.through.objects.filter(
+                **{f"{m2m.m2m_field_name()}__retired_at__isnull": True}
+            ).values_list(
+                f"{m2m.m2m_field_name()}_id", f"{m2m.m2m_reverse_field_name()}_id"
+            )
+            pairs[field] = tuple(zip(*links)) or ((), ())
+        recommender = cls.from_pairs(movie_pks, pairs)
+        recommender.catalog_version = catalog_version
+        print(f"✅ Content recommender ready with {len(movie_pks)} movies "
+              f"and {len(recommender.columns)} features")
+        return recommender
+
+    def rows_for(self, movie_pks):
+        """
+        Map Movie primary keys to matrix rows. Returns the rows and a boolean
+        mask telling which of the given pks are in the catalog.
+        """
+        movie_pks = np.asarray(movie_pks, dtype=np.int64)
+        if not len(self.movie_pks):
+            return np.empty(0, dtype=np.int64), np.zeros(len(movie_pks), dtype=bool)
+        pos = np.searchsorted(self.movie_pks, movie_pks, sorter=self._sorter)
+        rows = self._sorter[np.minimum(pos, len(self.movie_pks) - 1)]
+        known = self.movie_pks[rows] == movie_pks
+        return rows[known], known
+
+    def profile(self, user_ratings_dict=None, genre_ids=()):
+        """
+        Taste profile from {movie pk: rating} and stated genre preferences.
+        Ratings are centred on 2.5, so a disliked movie pushes its features down.
+        """
+        profile = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        if user_ratings_dict:
+            rows, known = self.rows_for(list(user_ratings_dict.keys()))
+            weights = np.asarray(list(user_ratings_dict.values()), dtype=np.float32)[known] - 2.5
+            profile += self.matrix[rows].T @ weights
+        genre_cols = [self.columns[("genres", g)] for g in genre_ids if ("genres", g) in self.columns]
+        profile[genre_cols] += 1
+        return profile
+
+    def recommend(self, user_ratings_dict=None, genre_ids=(), top_n=10):
+        """
+        Movie pks of the top_n movies closest to the profile, skipping rated ones.
+        Returns an empty list when nothing about the user is known.
+        """
+        profile = self.profile(user_ratings_dict, genre_ids)
+        if not profile.any():
+            return []
+        scores = self.matrix @ profile
+        if user_ratings_dict:
+            scores[self.rows_for(list(user_ratings_dict.keys()))[0]] = -np.inf
+        top_n = min(top_n, len(scores))
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+        top = top[np.argsort(-scores[top])]
+        return self.movie_pks[top[np.isfinite(scores[top]) & (scores[top] > 0)]].tolist()
+
+
+_content_recommender = None
+_content_recommender_lock = threading.Lock()
+_refresher = None
+
+
+def _refresh_on_catalog_change():
+    """
+    Imports and syncs run in their own process; serving workers notice them
+    through the catalog version.
+    """
+    while True:
+        time.sleep(settings.CATALOG_CHECK_INTERVAL)
+        try:
+            if Movie.objects.version() != _content_recommender.catalog_version:
+                refresh_content_recommender()
+        except Exception as e:
+            print(f"❌ Content recommender refresh failed: {e}")
+        finally:
+            close_old_connections()
+
+
+def get_content_recommender():
+    """
+    Return the process-wide content recommender, building it on first use.
+    """
+    global _content_recommender, _refresher
+    if _content_recommender is None:
+        with _content_recommender_lock:
+            if _content_recommender is None:
+                _content_recommender = ContentRecommender.from_database()
+                if settings.CATALOG_CHECK_INTERVAL > 0:
+                    _refresher = threading.Thread(target=_refresh_on_catalog_change, name="content-recommender",
+                                                  daemon=True)
+                    _refresher.start()
+    return _content_recommender
+
+
+def refresh_content_recommender():
+    """
+    Rebuild the item matrix after the catalog changed.
+    """
+    global _content_recommender
+    _content_recommender = ContentRecommender.from_database()
@@ -0,0 +1,202 @@
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+from django.conf import settings
+
+from .benchmarks import synthetic_recommender
+from .group_recommender import recommend_for_group
+from .ml_model import device
+from .ml_model_train import fit_ratings, movie_vocabulary
+from .ratings_store import RatingsStore
+
+RELEVANT_RATING = 4.0
+
+
+# ------------------ Quality ------------------
+def holdout_split(data, test_fraction=0.2, min_ratings=5, seed=0):
+    """
+    Hold out test_fraction of the ratings of every user with at least
+    min_ratings ratings. Returns boolean (train, test) masks over the rows.
+    """
+    rng = np.random.default_rng(seed)
+    users = np.asarray(data["userId"])
+    order = np.lexsort((rng.random(len(users)), users))  # users grouped, shuffled within
+    sorted_users = users[order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    counts = np.diff(np.r_[starts, len(users)])
+    # Position of each row within its user's shuffled ratings
+    position = np.arange(len(users)) - np.repeat(starts, counts)
+    held_out = (np.repeat(counts, counts) >= min_ratings) & (position < np.repeat(counts * test_fraction, counts))
+
+    test = np.zeros(len(users), dtype=bool)
+    test[order[held_out]] = True
+    return ~test, test
+
+
+def _user_groups(users):
+    """
+    Row indices of every user, for user-sorted rows.
+    """
+    order = np.argsort(users, kind="stable")
+    sorted_users = users[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1], True])
+    return {int(sorted_users[a]): order[a:b] for a, b in zip(bounds[:-1], bounds[1:])}
+
+
+def evaluate_quality(recommender, data, train, test, k=10, max_users=1000, seed=0):
+    """
+    RMSE of the predicted ratings of held-out movies, and precision/recall@k
+    of recommend() against the held-out movies rated RELEVANT_RATING or more.
+    """
+    users, movies, ratings = (np.asarray(data[c]) for c in ("userId", "movieId", "rating"))
+    train_rows, test_rows = _user_groups(users[train]), _user_groups(users[test])
+    train_idx, test_idx = np.flatnonzero(train), np.flatnonzero(test)
+    eval_users = sorted(set(train_rows) & set(test_rows))
+    rng = np.random.default_rng(seed)
+    if len(eval_users) > max_users:
+        eval_users = sorted(rng.choice(eval_users, max_users, replace=False).tolist())
+
+    squared_errors, precisions, recalls = [], [], []
+    for user in eval_users:
+        tr, te = train_idx[train_rows[user]], test_idx[test_rows[user]]
+        user_ratings = dict(zip(movies[tr].tolist(), ratings[tr].tolist()))
+        try:
+            user_emb = recommender.user_embedding(user_ratings)
+        except ValueError:
+            continue
+        rows, known = recommender.rows_for(movies[te])
+        if len(rows):
+            predicted = recommender.score(torch.as_tensor(user_emb, dtype=torch.float32, device=device))
+            squared_errors.extend(((predicted[rows].cpu().numpy() - ratings[te][known]) ** 2).tolist())
+        relevant = set(movies[te][ratings[te] >= RELEVANT_RATING].tolist())
+        if relevant:
+            hits = len(relevant & set(recommender.recommend_for_embedding(user_emb, user_ratings.keys(), k)))
+            precisions.append(hits / k)
+            recalls.append(hits / len(relevant))
+
+    return {
+        "users": len(eval_users),
+        "rmse": float(np.sqrt(np.mean(squared_errors))) if squared_errors else None,
+        f"precision_at_{k}": float(np.mean(precisions)) if precisions else None,
+        f"recall_at_{k}": float(np.mean(recalls)) if recalls else None,
+    }
+
+
+def evaluate_on_holdout(data, k=10, max_users=1000, epochs=5, current_recommender=None):
+    """
+    Train a model on the training split and evaluate it on the held-out split.
+    The current model, if given, is also evaluated; it has usually seen the
+    held-out ratings, so its numbers are an optimistic upper bound.
+    """
+    from .ml_model import Recommender
+
+    train, test = holdout_split(data)
+    report = {"ratings": int(len(train)), "held_out": int(test.sum())}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = RatingsStore(os.path.join(tmp, "train"))
+        store.write_segment({column: np.asarray(values)[train] for column, values in data.items()})
+        movie_ids = movie_vocabulary(store.load()["movieId"])
+        model = fit_ratings(store, movie_ids, epochs=epochs)
+    model.eval()
+    report["holdout_model"] = evaluate_quality(Recommender(model, movie_ids), data, train, test, k, max_users)
+    if current_recommender is not None:
+        report["current_model"] = evaluate_quality(current_recommender, data, train, test, k, max_users)
+        report["current_model"]["version"] = current_recommender.version
+    return report
+
+
+# ------------------ Latency ------------------
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _latency(fn, calls):
+    timings = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    p50, p99 = np.percentile(timings, [50, 99]) * 1000
+    return {"p50_ms": float(p50), "p99_ms": float(p99)}
+
+
+def benchmark_latency(num_movies, requests=50, group_size=5, batch_size=16, top_n=50, seed=0, quantize=False):
+    """
+    p50/p99 latency of single-user, group and batched inference on a
+    synthetic catalog, and the process's peak RSS afterwards.
+    """
+    recommender = synthetic_recommender(num_movies, quantize=quantize)
+    rng = np.random.default_rng(seed)
+    dim = recommender.model.movie_embedding.embedding_dim
+
+    def rated():
+        return rng.choice(recommender.movie_ids, 20, replace=False)
+
+    single = [(rng.standard_normal(dim).astype(np.float32), rated(), top_n) for _ in range(requests)]
+    groups = [
+        ([(member, int(movie_id), float(rng.integers(1, 6))) for member in range(group_size) for movie_id in rated()],
+         "average", top_n, recommender)
+        for _ in range(requests)
+    ]
+    batches = [
+        (torch.as_tensor(rng.standard_normal((batch_size, dim)), dtype=torch.float32, device=device),
+         [recommender.rows_for(rated())[0] for _ in range(batch_size)])
+        for _ in range(max(1, requests // 5))
+    ]
+
+    def batched(user_embs, exclude_rows):
+        return recommender.top_k_batch(recommender.score_batch(user_embs), exclude_rows, top_n)
+
+    # Warm up every path once
+    recommender.recommend_for_embedding(*single[0])
+    recommend_for_group(*groups[0])
+    batched(*batches[0])
+
+    report = {
+        "single_user": _latency(recommender.recommend_for_embedding, single),
+        "group": _latency(recommend_for_group, groups),
+        "batched": _latency(batched, batches),
+    }
+    report["batched"]["batch_size"] = batch_size
+    report["group"]["group_size"] = group_size
+    report["peak_rss_mb"] = _peak_rss_mb()
+    return report
+
+
+# ------------------ Report ------------------
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(data=None, catalog_sizes=(10000, 45000), k=10, max_users=1000, epochs=5,
+                 current_recommender=None):
+    """
+    Quality and latency report as a JSON-serialisable dict. Quality is
+    skipped when there are no ratings to evaluate on.
+    """
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "torch_threads": torch.get_num_threads(),
+        "quantized": settings.RECOMMENDER_QUANTIZE,
+    }
+    if data is not None and len(data["rating"]):
+        print("🧪 Evaluating recommendation quality...")
+        report["quality"] = evaluate_on_holdout(data, k, max_users, epochs, current_recommender)
+    report["latency"] = {}
+    # Ascending sizes, so each peak RSS is the peak for that size
+    for num_movies in sorted(catalog_sizes):
+        print(f"⏱️ Benchmarking a {num_movies}-movie catalog...")
+        report["latency"][str(num_movies)] = benchmark_latency(num_movies, quantize=report["quantized"])
+    return report
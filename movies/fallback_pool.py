@@ -0,0 +1,74 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Genre, Movie
+from .serializers import MovieSerializer
+
+# Pre-serialized most popular movies, overall (key None) and per genre name,
+# so the cold-start responses need no database work.
+_pools = None
+# Movie.objects.version() of the catalog the pools were built from
+_pools_version = None
+_pools_lock = threading.Lock()
+_refresher = None
+
+
+def _top_movies(queryset):
+    movies = queryset.order_by('-popularity').prefetch_related('genres')[:settings.FALLBACK_POOL_SIZE]
+    return [dict(movie) for movie in MovieSerializer(movies, many=True).data]
+
+
+def refresh_fallback_pools():
+    """
+    Rebuild the pools from the catalog. Called on a schedule and when an
+    import or sync changed the catalog.
+    """
+    global _pools, _pools_version
+    # Read first, so a sync committing mid-refresh triggers another one
+    version = Movie.objects.version()
+    pools = {None: _top_movies(Movie.objects.active())}
+    for genre in Genre.objects.all():
+        pools[genre.name] = _top_movies(genre.movies.active())
+    _pools, _pools_version = pools, version
+    print(f"🍿 Fallback pools refreshed ({len(pools) - 1} genres)")
+    return pools
+
+
+def _refresh_periodically():
+    intervals = [i for i in (settings.FALLBACK_POOL_REFRESH_INTERVAL, settings.CATALOG_CHECK_INTERVAL) if i > 0]
+    refreshed = time.monotonic()
+    while True:
+        time.sleep(min(intervals))
+        try:
+            due = 0 < settings.FALLBACK_POOL_REFRESH_INTERVAL <= time.monotonic() - refreshed
+            if due or (settings.CATALOG_CHECK_INTERVAL > 0 and Movie.objects.version() != _pools_version):
+                refresh_fallback_pools()
+                refreshed = time.monotonic()
+        except Exception as e:
+            print(f"❌ Fallback pool refresh failed: {e}")
+        finally:
+            close_old_connections()
+
+
+def get_fallback_pool(genre=None):
+    """
+    Popular movies for a genre name, or overall. Unknown genres get the overall pool.
+    """
+    global _refresher
+    if _pools is None:
+        with _pools_lock:
+            if _pools is None:
+                refresh_fallback_pools()
+                if settings.FALLBACK_POOL_REFRESH_INTERVAL > 0 or settings.CATALOG_CHECK_INTERVAL > 0:
+                    _refresher = threading.Thread(target=_refresh_periodically, name="fallback-pool", daemon=True)
+                    _refresher.start()
+    return _pools.get(genre) or _pools[None]
+
+
+def sample_fallback(k=5, genre=None):
+    pool = get_fallback_pool(genre)
+    return random.sample(pool, min(k, len(pool)))
@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+from django.conf import settings
+
+from .ml_model import device, get_recommender
+
+# How the per-member score rows are combined into one group score per movie
+AGGREGATION_STRATEGIES = {
+    "average": lambda scores: scores.mean(dim=0),
+    "least_misery": lambda scores: scores.min(dim=0).values,
+    "most_pleasure": lambda scores: scores.max(dim=0).values,
+}
+
+
+def member_embeddings(recommender, user_ids, movie_ids, ratings):
+    """
+    Build every member's user embedding in one batched op from flat
+    (user_id, movieId, rating) columns. Members without a rated movie known
+    to the model get no embedding. Returns a (members, dim) tensor.
+    """
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    rows, known = recommender.rows_for(movie_ids)
+    if not known.any():
+        raise ValueError("No valid rated movies found in dataset.")
+    _, members = np.unique(np.asarray(user_ids)[known], return_inverse=True)
+    members = torch.from_numpy(members).to(device)
+    weights = torch.as_tensor(np.asarray(ratings, dtype=np.float32)[known], device=device)
+
+    with torch.no_grad():
+        weighted = recommender.model.movie_embedding(torch.from_numpy(rows).to(device)).float() * weights.unsqueeze(1)
+        num_members = int(members.max()) + 1
+        sums = torch.zeros(num_members, weighted.shape[1], device=device).index_add_(0, members, weighted)
+        counts = torch.bincount(members, minlength=num_members).unsqueeze(1)
+    return sums / counts
+
+
+def recommend_for_group(group_ratings, strategy="average", top_n=10, recommender=None, candidate_pool=None):
+    """
+    Recommend movies for a group from its members' (user_id, movieId, rating)
+    rows, combining the members' score rows with the given aggregation
+    strategy. Movies any member already rated are skipped.
+
+    With the default candidate_pool of 0 every member is scored on every
+    movie, in one batched pass. A positive pool is an opt-in approximation:
+    the catalog is first shortlisted to the candidate_pool best movies for
+    the group's mean embedding and the members are scored on the shortlist
+    only. The model is nonlinear, so the shortlist can miss the exact
+    least_misery and most_pleasure picks.
+    """
+    recommender = recommender or get_recommender()
+    aggregate = AGGREGATION_STRATEGIES[strategy]
+    candidate_pool = settings.GROUP_CANDIDATE_POOL if candidate_pool is None else candidate_pool
+    user_ids, movie_ids, ratings = zip(*group_ratings)
+    user_embs = member_embeddings(recommender, user_ids, movie_ids, ratings)
+    rated_rows, _ = recommender.rows_for(list(set(movie_ids)))
+
+    if not 0 < candidate_pool < recommender.num_movies:
+        scores = aggregate(recommender.score_batch(user_embs))
+        return recommender.top_k(scores, rated_rows, top_n)
+
+    shortlist = recommender.top_k_rows(recommender.score(user_embs.mean(dim=0)), rated_rows, candidate_pool)
+    scores = aggregate(recommender.score_rows(user_embs, shortlist))
+    best = torch.topk(scores, min(top_n, len(shortlist))).indices.cpu().numpy()
+    return recommender.movie_ids[shortlist[best]].tolist()
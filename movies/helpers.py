@@ -1,8 +1,7 @@
-import csv
-
 from django.db import transaction
-from datetime import datetime
+from django.utils import timezone
 import os
+import numpy as np
 import pandas as pd
 from movies.models import (
     Movie, Rating, Genre, Keyword, ProductionCompany,
@@ -10,48 +9,78 @@ from movies.models import (
 )
 from django.conf import settings
 
-DEFAULT_POSTER = ""
-DEFAULT_BACKDROP = ""
+from .catalog_preprocess import load_catalog
+from .ratings_store import app_user_id, exported_ratings_store, filtered_ratings_store, movielens_ratings_store
 
-@transaction.atomic
-def update_database():
+# Rows per INSERT for the bulk catalog import
+BULK_BATCH_SIZE = 5000
+# Movie M2M fields and their vocabulary models
+M2M_FIELDS = {
+    "genres": Genre,
+    "keywords": Keyword,
+    "production_companies": ProductionCompany,
+    "production_countries": ProductionCountry,
+    "spoken_languages": SpokenLanguage,
+}
+
+
+def _nullable(series):
     """
-    Updates the entire database using TMDB + MovieLens datasets.
-    Keeps only movies present in both datasets.
-    Handles Many-to-Many fields: genres, keywords, production_companies,
-    production_countries, spoken_languages.
+    Column as Python objects with NaN/NaT replaced by None, ready for the ORM.
     """
-    # --- Paths ---
-    tmdb_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "tmdbmovies.csv")
-    movielens_movies_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "movies.csv")
-    movielens_links_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "links.csv")
+    return series.astype(object).where(series.notna(), None)
 
 
-    print("📥 Loading datasets...")
-    tmdb_df = pd.read_csv(tmdb_path)
-    ml_movies = pd.read_csv(movielens_movies_path)
-    ml_links = pd.read_csv(movielens_links_path)
+def _movie_fields(movies):
+    """
+    The Movie field values of the preprocessed catalog rows, as Python objects.
+    """
+    fields = movies.assign(release_date=movies["release_date"].dt.date)
+    fields = pd.DataFrame({name: _nullable(values) for name, values in fields.items()})
+    fields["synced_at"] = timezone.now()
+    return fields
 
 
-    tmdb_df['id'] = tmdb_df['id'].astype(int)
+def _m2m_items(catalog, field_name, movie_pks):
+    """
+    (movie_pk, name) rows of a M2M field for the movies in {tmdb_id: pk}.
+    """
+    items = catalog[field_name]
+    return pd.DataFrame({"movie_pk": items["tmdb_id"].map(movie_pks), "name": items["name"]}).dropna()
 
-    # --- Merge MovieLens movies with links ---
-    ml_merged = pd.merge(ml_movies, ml_links, on="movieId", how="inner")
-    ml_merged = ml_merged.dropna(subset=['tmdbId'])
-    ml_merged['tmdbId'] = ml_merged['tmdbId'].astype(int)
-    ml_merged = ml_merged[['movieId', 'tmdbId']]
 
-    # --- Merge with TMDB dataset (only common movies) ---
-    combined = pd.merge(
-        tmdb_df,
-        ml_merged,
-        left_on='id',
-        right_on='tmdbId',
-        how='inner',
-        suffixes=('_tmdb', '_ml')
-    )
-    print(combined.head())
-    print(f"✅ Found {len(combined)} movies common to both TMDB and MovieLens")
+def _m2m_links(field_name, model_class, items):
+    """
+    The through model of a M2M field, its column names, and the (movie pk, item pk)
+    links of the items. Names not in the vocabulary yet are created.
+    """
+    model_class.objects.bulk_create([model_class(name=n) for n in items["name"].unique()],
+                                    batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    name_pks = dict(model_class.objects.values_list("name", "pk"))
+
+    m2m = getattr(Movie, field_name).field
+    columns = f"{m2m.m2m_field_name()}_id", f"{m2m.m2m_reverse_field_name()}_id"
+    links = pd.DataFrame({columns[0]: items["movie_pk"].astype("int64"),
+                          columns[1]: items["name"].map(name_pks).astype("int64")})
+    return m2m.remote_field.through, columns, links
+
+
+def _chunks(values, size=BULK_BATCH_SIZE):
+    values = list(values)
+    return (values[i : i + size] for i in range(0, len(values), size))
+
+
+@transaction.atomic
+def update_database():
+    """
+    Updates the entire database using TMDB + MovieLens datasets.
+    Keeps only movies present in both datasets.
+    Handles Many-to-Many fields: genres, keywords, production_companies,
+    production_countries, spoken_languages.
+    Deletes every movie and rating first; sync_database() updates in place.
+    Running servers pick up the new catalog through Movie.objects.version().
+    """
+    catalog = load_catalog()
 
     # --- Clear old data ---
     Movie.objects.all().delete()
@@ -62,92 +91,131 @@ def update_database():
     ProductionCountry.objects.all().delete()
     SpokenLanguage.objects.all().delete()
 
-    # --- Update / Create Movies ---
-    for _, row in combined.iterrows():
-        try:
-            poster = f"https://image.tmdb.org/t/p/original{row.get('poster_path')}" if pd.notna(row.get('poster_path')) else DEFAULT_POSTER
-            backdrop = f"https://image.tmdb.org/t/p/original{row.get('backdrop_path')}" if pd.notna(row.get('backdrop_path')) else DEFAULT_BACKDROP
-
-            movie, created = Movie.objects.update_or_create(
-                tmdb_id=row["id"],
-                defaults={
-                    "movieId":row.get("movieId"),
-                    "title": row.get("title"),
-                    "original_title":row.get("original_title"),
-                    "overview": row.get("overview"),
-                    "tagline": row.get("tagline"),
-                    "status": row.get("status"),
-                    "release_date": (
-                        datetime.strptime(str(row["release_date"]), "%Y-%m-%d").date()
-                        if pd.notna(row.get("release_date")) else None
-                    ),
-                    "runtime": row.get("runtime"),
-                    "revenue": row.get("revenue"),
-                    "budget": row.get("budget"),
-                    "adult": bool(row.get("adult", False)),
-                    "vote_average": row.get("vote_average"),
-                    "vote_count": row.get("vote_count"),
-                    "popularity": row.get("popularity"),
-                    "imdb_id": f"tt{int(row['imdbId']):07d}" if pd.notna(row.get("imdbId")) else None,
-                    "original_language": row.get("original_language"),
-                    "poster_path": poster,
-                    "backdrop_path": backdrop,
-                    "homepage": row.get("homepage"),
-                },
-            )
-
-            # --- Handle Many-to-Many fields ---
-            m2m_fields = {
-                "genres": Genre,
-                "keywords": Keyword,
-                "production_companies": ProductionCompany,
-                "production_countries": ProductionCountry,
-                "spoken_languages": SpokenLanguage,
-            }
-
-            for field_name, model_class in m2m_fields.items():
-                items_str = row.get(field_name, "")
-                if pd.notna(items_str):
-                    items_list = [i.strip() for i in items_str.split(",") if i.strip()]
-                    objs = [model_class.objects.get_or_create(name=i)[0] for i in items_list]
-                    getattr(movie, field_name).set(objs)
-
-            movie.save()
-
-        except Exception as e:
-            print(f"❌ Error saving movie {row.get('title', 'Unknown')}: {e}")
+    # --- Bulk create Movies ---
+    movie_fields = _movie_fields(catalog["movies"])
+    movies = [Movie(**fields) for fields in movie_fields.to_dict("records")]
+    Movie.objects.bulk_create(movies, batch_size=BULK_BATCH_SIZE)
+    movie_pks = dict(Movie.objects.values_list("tmdb_id", "pk"))
+    print(f"🎬 Inserted {len(movies)} movies")
+
+    # --- Handle Many-to-Many fields ---
+    for field_name, model_class in M2M_FIELDS.items():
+        items = _m2m_items(catalog, field_name, movie_pks)
+        through, columns, links = _m2m_links(field_name, model_class, items)
+        through.objects.bulk_create([through(**link) for link in links.to_dict("records")],
+                                    batch_size=BULK_BATCH_SIZE)
+        print(f"🔗 {field_name}: {items['name'].nunique()} names, {len(links)} links")
 
     print("🎬 Movies and related M2M fields updated successfully!")
 
     print("🎉 Database update complete!")
 
 
+@transaction.atomic
+def sync_database():
+    """
+    Brings the catalog in line with the TMDB + MovieLens datasets without
+    deleting anything. Rows are compared by tmdb_id and source_hash: only new
+    and changed movies are written and only their M2M links are diffed.
+    Movies no longer in the datasets are retired, keeping their ratings,
+    comments and poll options. Returns the number of added, changed,
+    retired and unchanged movies.
+
+    Running servers need no restart: every written or retired movie gets a
+    new synced_at, and each worker rebuilds its fallback pools and content
+    recommender within CATALOG_CHECK_INTERVAL seconds of the commit.
+    """
+    catalog = load_catalog()
+    movie_fields = _movie_fields(catalog["movies"])
+    movie_fields["retired_at"] = None
+
+    existing = {tmdb_id: (pk, source_hash, retired_at) for tmdb_id, pk, source_hash, retired_at
+                in Movie.objects.values_list("tmdb_id", "pk", "source_hash", "retired_at")}
+    current = movie_fields["tmdb_id"].map(lambda tmdb_id: existing.get(tmdb_id, (None, None, None)))
+    is_new = current.map(lambda row: row[0] is None)
+    stored_hash = current.map(lambda row: row[1])
+    # A retired movie that came back is written even when unchanged, to clear retired_at
+    was_retired = current.map(lambda row: row[2] is not None)
+    is_changed = ~is_new & ((stored_hash != movie_fields["source_hash"]) | was_retired)
+    print(f"🔍 {is_new.sum()} new and {is_changed.sum()} changed movies")
+
+    # --- Upsert Movies ---
+    Movie.objects.bulk_create([Movie(**fields) for fields in movie_fields[is_new].to_dict("records")],
+                              batch_size=BULK_BATCH_SIZE)
+    changed_fields = movie_fields[is_changed].assign(pk=current[is_changed].map(lambda row: row[0]))
+    Movie.objects.bulk_update([Movie(**fields) for fields in changed_fields.to_dict("records")],
+                              [name for name in movie_fields if name != "tmdb_id"], batch_size=BULK_BATCH_SIZE)
+
+    # --- Retire removed movies ---
+    incoming = set(movie_fields["tmdb_id"].tolist())
+    retired_pks = [pk for tmdb_id, (pk, _, retired_at) in existing.items()
+                   if tmdb_id not in incoming and retired_at is None]
+    now = timezone.now()
+    for pks in _chunks(retired_pks):
+        Movie.objects.filter(pk__in=pks).update(retired_at=now, synced_at=now)
+
+    # --- Diff Many-to-Many fields of the written movies ---
+    movie_pks = dict(Movie.objects.values_list("tmdb_id", "pk"))
+    written_pks = {tmdb_id: movie_pks[tmdb_id] for tmdb_id in movie_fields.loc[is_new | is_changed, "tmdb_id"]}
+    for field_name, model_class in M2M_FIELDS.items():
+        through, (movie_column, item_column), wanted = _m2m_links(
+            field_name, model_class, _m2m_items(catalog, field_name, written_pks))
+        stored = pd.DataFrame(
+            [row for pks in _chunks(written_pks.values()) for row in through.objects.filter(**{f"{movie_column}__in": pks})
+             .values_list("pk", movie_column, item_column)],
+            columns=["pk", movie_column, item_column],
+        )
+        diff = stored.merge(wanted, on=[movie_column, item_column], how="outer", indicator=True)
+        removed = diff.loc[diff["_merge"] == "left_only", "pk"].astype("int64").tolist()
+        added = diff.loc[diff["_merge"] == "right_only", [movie_column, item_column]]
+        for pks in _chunks(removed):
+            through.objects.filter(pk__in=pks).delete()
+        through.objects.bulk_create([through(**link) for link in added.to_dict("records")],
+                                    batch_size=BULK_BATCH_SIZE)
+        print(f"🔗 {field_name}: +{len(added)} / -{len(removed)} links")
+
+    counts = {
+        "added": int(is_new.sum()),
+        "changed": int(is_changed.sum()),
+        "retired": len(retired_pks),
+        "unchanged": int((~is_new & ~is_changed).sum()),
+    }
+    print(f"🎉 Catalog synced: {counts}")
+    return counts
+
+
 def export_filtered_ratings():
     """
     Filters MovieLens ratings to include only movies that exist in the Movie table.
-    Saves the filtered ratings as a CSV.
+    Saves them as the exported ratings store, like filtered_ratings_small.csv
+    was; the training store (filtered_ratings.csv) is left alone.
     """
     ratings_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "ratings_small.csv")
-    output_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "filtered_ratings_small.csv")
+    source = movielens_ratings_store()
+    if not source.exists():
+        # Parsed once; later exports memory-map the imported columns
+        source.import_csv(ratings_path)
     print("📥 Loading ratings dataset...")
-    ml_ratings = pd.read_csv(ratings_path)
-    print(f"Total ratings loaded: {len(ml_ratings)}")
+    ml_ratings = source.load()
+    print(f"Total ratings loaded: {len(ml_ratings['rating'])}")
 
     print("🔍 Getting existing movies from DB...")
-    existing_movie_ids = set(Movie.objects.values_list("movieId", flat=True))
+    # Retired movies are left out, so the model stops recommending them
+    existing_movie_ids = np.fromiter(
+        Movie.objects.active().filter(movieId__isnull=False).values_list("movieId", flat=True), dtype=np.int32
+    )
     print(f"Movies in DB: {len(existing_movie_ids)}")
 
-    # Convert to string for matching if stored as text
-    ml_ratings["movieId"] = ml_ratings["movieId"].astype(str)
-
     # Filter only ratings of movies that exist
-    filtered_ratings = ml_ratings[ml_ratings["movieId"].isin(existing_movie_ids)]
+    keep = np.isin(ml_ratings["movieId"], existing_movie_ids)
+    filtered_ratings = {column: values[keep] for column, values in ml_ratings.items()}
 
-    print(f"✅ Filtered {len(filtered_ratings)} ratings that match existing movies")
+    print(f"✅ Filtered {len(filtered_ratings['rating'])} ratings that match existing movies")
 
-    # Save to CSV
-    filtered_ratings.to_csv(output_path, index=False)
-    print(f"💾 Saved filtered ratings to {output_path}")
+    # Replaces the previous export
+    store = exported_ratings_store()
+    store.write_segment(filtered_ratings, replace=True)
+    print(f"💾 Saved filtered ratings to {store.path}")
 
 
 from django.db.models import Q
@@ -177,8 +245,9 @@ def search_by(search_term:str):
     # Example output: [15, 22, 101, 345, ...]
     return movie_ids[:10]
 
-def write_rating_to_csv(new_row):
-    file_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "filtered_ratings_small.csv")
-    with open(file_path, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=["userId", "movieId", "rating", "timestamp"])
-        writer.writerow(new_row)
\ No newline at end of file
+def append_rating(user_id, movie_id, rating, timestamp=None):
+    """
+    Record an in-app rating (rating=None for a deletion) in the ratings store
+    training reads from. user_id is the app user's pk.
+    """
+    filtered_ratings_store().append(app_user_id(user_id), movie_id, rating, timestamp)
@@ -0,0 +1,38 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import model_registry
+from movies.ml_model import load_model
+from movies.ml_model_train import export_neighbours, has_model_arrays
+
+
+class Command(BaseCommand):
+    help = "Precompute the similar movies index of a published model version."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-version", help="Registry version, the current one by default.")
+        parser.add_argument("-k", type=int, default=settings.SIMILAR_MOVIES_K, help="Neighbours kept per movie.")
+
+    def handle(self, *args, **options):
+        version = options["model_version"] or model_registry.current_version()
+        if version is None:
+            raise CommandError("No model version has been published yet.")
+        directory = model_registry.version_dir(version)
+        if has_model_arrays(directory):
+            embeddings = np.load(os.path.join(directory, "movie_embedding.npy"), mmap_mode="r")
+        elif os.path.isfile(model_registry.checkpoint_path(version)):
+            model, _ = load_model(model_registry.checkpoint_path(version))
+            embeddings = model.movie_embedding.weight.detach().cpu().numpy()
+        else:
+            raise CommandError(f"Model version {version} is not published.")
+
+        start = time.perf_counter()
+        export_neighbours(embeddings, directory, options["k"])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {options['k']} neighbours of {len(embeddings)} movies written to {directory} "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
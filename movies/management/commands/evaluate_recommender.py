@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from movies.evaluation import build_report
+from movies.ml_model import get_recommender
+from movies.ratings_store import filtered_ratings_store
+
+
+class Command(BaseCommand):
+    help = "Evaluate recommendation quality and inference latency and write a JSON report."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="recommender_report.json", help="Report path, '-' for stdout.")
+        parser.add_argument("--catalog-sizes", default="10000,45000",
+                            help="Comma-separated synthetic catalog sizes for the latency benchmark.")
+        parser.add_argument("-k", type=int, default=10, help="Cut-off for precision and recall.")
+        parser.add_argument("--max-users", type=int, default=1000, help="Held-out users evaluated.")
+        parser.add_argument("--epochs", type=int, default=5, help="Epochs of the model trained on the split.")
+        parser.add_argument("--skip-quality", action="store_true", help="Only run the latency benchmark.")
+
+    def handle(self, *args, **options):
+        data, current = None, None
+        if not options["skip_quality"]:
+            store = filtered_ratings_store()
+            if store.exists():
+                # Evaluated on the newest rating of every user and movie, as training sees them
+                store.compact()
+                data = store.load()
+                try:
+                    current = get_recommender()
+                except Exception as e:
+                    self.stderr.write(f"⚠️ Current model not evaluated: {e}")
+            else:
+                self.stderr.write("⚠️ No ratings store, skipping the quality evaluation")
+
+        report = build_report(
+            data,
+            catalog_sizes=[int(size) for size in options["catalog_sizes"].split(",")],
+            k=options["k"],
+            max_users=options["max_users"],
+            epochs=options["epochs"],
+            current_recommender=current,
+        )
+        output = json.dumps(report, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(output)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"✅ Report written to {options['output']}"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.precomputed import precompute_recommendations
+
+
+class Command(BaseCommand):
+    help = "Precompute the top-N recommendations of every user with ratings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-n", type=int, default=50, help="Recommendations kept per user.")
+        parser.add_argument("--workers", type=int, help="Worker processes, one per CPU by default.")
+        parser.add_argument("--block-size", type=int, default=256, help="Users scored per matrix product.")
+
+    def handle(self, *args, **options):
+        try:
+            meta = precompute_recommendations(options["top_n"], options["workers"], options["block_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Snapshot {meta['file']} for model {meta['model_version']} ({meta['num_users']} users)"
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies.helpers import sync_database, update_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync the movie catalog with the TMDB and MovieLens datasets. Running servers pick up "
+        "the changes within CATALOG_CHECK_INTERVAL seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true",
+                            help="Delete every movie and rating and reimport the catalog.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options["full"]:
+            update_database()
+            summary = "reimported"
+        else:
+            counts = sync_database()
+            summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Catalog {summary} in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0005_usertaste"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movie",
+            name="retired_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="movie",
+            name="source_hash",
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
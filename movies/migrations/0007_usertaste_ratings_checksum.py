@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0006_movie_source_hash_retired_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usertaste",
+            name="ratings_checksum",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+    ]
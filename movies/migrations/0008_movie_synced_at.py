@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0007_usertaste_ratings_checksum"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movie",
+            name="synced_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
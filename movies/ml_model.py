@@ -1,91 +1,331 @@
 import os
+import threading
+import time
+
+import numpy as np
 import torch
 import pandas as pd
 from django.conf import settings
-from .ml_model_train import NCF
-from .models import Movie
+from . import model_registry
+from .ml_model_train import NCF, has_model_arrays, has_neighbours
 
 # ------------------ Configuration ------------------
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"⚙️ Using device: {device}")
 
+RATINGS_CSV_PATH = os.path.join(settings.BASE_DIR, "movielens_dataset", "filtered_ratings_small.csv")
+MODEL_PATH = os.path.join(settings.BASE_DIR, "movielens_dataset", "ml_model_ncf.pth")
+
+# Upper bound for the (users, movies, hidden) activations of one scoring pass
+SCORE_CHUNK_BYTES = 64 * 1024 * 1024
+
+
 # ------------------ Load model ------------------
 def load_model(model_path):
+    """
+    Load an NCF checkpoint. Returns the model and the movieId stored in each
+    embedding row, or None for checkpoints saved without a vocabulary.
+    """
     checkpoint = torch.load(model_path, map_location=device)
     num_movies = checkpoint["num_movies"]
-    model = NCF(num_movies)
+    model = NCF(num_movies, checkpoint.get("embedding_dim", 50))
     model.load_state_dict(checkpoint["model_state_dict"])
     model.to(device)
     model.eval()
-    return model, num_movies
+    movie_ids = checkpoint.get("movie_ids")
+    if movie_ids is not None:
+        movie_ids = movie_ids.cpu().numpy()
+    return model, movie_ids
 
 
+def load_model_arrays(array_dir):
+    """
+    Load a model exported with export_model_arrays. The movie ids, embedding
+    and projection tables are memory-mapped, not read: worker processes share
+    their pages and a cold worker can serve right away.
+    Returns the model, the movieId of each row and the movie projection.
+    """
+    def mmap(name):
+        # Copy-on-write mapping; the tables are never written, so pages stay shared
+        return np.load(os.path.join(array_dir, name), mmap_mode="c")
+
+    layers = torch.load(os.path.join(array_dir, "fc_layers.pth"), map_location=device)
+    model = NCF(0, layers["embedding_dim"])
+    model.fc_layers.load_state_dict(layers["fc_layers_state_dict"])
+    model.movie_embedding = torch.nn.Embedding.from_pretrained(torch.from_numpy(mmap("movie_embedding.npy")))
+    model.to(device)
+    model.eval()
+    movie_projection = torch.from_numpy(mmap("movie_projection.npy")).to(device)
+    return model, mmap("movie_ids.npy"), movie_projection
 
 
-# ------------------ Recommend function ------------------
-def recommend_movies(user_ratings_dict, top_n=10, batch_size=2000):
+def load_movie_ids(ratings_csv_path):
     """
-    Recommend movies for a new user based on their {movieId: rating} history.
+    Rebuild the movieId of each embedding row from the ratings CSV.
+    Only needed for checkpoints saved before the vocabulary was stored in them.
     """
-    # ------------------ Preload dataset ------------------
-    ratings_csv_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "filtered_ratings_small.csv")
-    model_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "ml_model_ncf.pth")
+    data = pd.read_csv(ratings_csv_path, usecols=["movieId"])
+    return data["movieId"].astype("category").cat.categories.values
 
-    # Load CSV once (keep in memory)
-    print("📂 Loading dataset...")
-    data = pd.read_csv(ratings_csv_path)
-    data = data.sort_values("timestamp").drop_duplicates(["userId", "movieId"], keep="last")
-    data["movie_idx"] = data["movieId"].astype("category").cat.codes
-    movie_id_map = dict(zip(data["movieId"], data["movie_idx"]))
-    print(f"✅ Loaded {len(movie_id_map)} unique movies")
 
-    # Load model once
-    model, _ = load_model(model_path)
-    print("✅ Model loaded successfully!")
+def quantize_for_inference(model, half_embedding=True):
+    """
+    Opt-in int8 CPU inference: the Linear layers after the first one are
+    dynamically quantized and the movie embedding table is kept in float16.
+    The first layer stays float32; its movie half is precomputed anyway.
+    """
+    tail = torch.ao.quantization.quantize_dynamic(model.fc_layers[3:], {torch.nn.Linear}, dtype=torch.qint8)
+    for i, layer in enumerate(tail):
+        model.fc_layers[3 + i] = layer
+    if half_embedding:
+        model.movie_embedding.half()
+    return model
 
-    # Filter out unseen movies
 
-    valid_rated = {m: r for m, r in user_ratings_dict.items() if m in movie_id_map}
-    if not valid_rated:
-        raise ValueError("No valid rated movies found in dataset.")
+# ------------------ Recommender service ------------------
+class Recommender:
+    """
+    Keeps the NCF model, the movieId -> index map and the candidate tensor
+    in memory so a recommendation request only has to do the scoring.
+    """
 
-    rated_movie_ids = [movie_id_map[m] for m in valid_rated.keys()]
-    ratings_tensor = torch.FloatTensor(list(valid_rated.values())).to(device)
-    movie_tensor = torch.LongTensor(rated_movie_ids).to(device)
+    def __init__(self, model, movie_ids, version="", quantize=False, movie_projection=None):
+        self.model = model
+        # Identifies the weights; user taste vectors built with other weights are stale
+        self.version = version
+        # movie_ids[i] is the movieId stored in embedding row i
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self._sorter = np.argsort(self.movie_ids, kind="stable")
+        self.num_movies = len(self.movie_ids)
+        # A given projection is memory-mapped and shared with other workers,
+        # so it is used as is instead of being converted to float16
+        shared_tables = movie_projection is not None
+        if not shared_tables:
+            with torch.no_grad():
+                movie_projection = model.movie_projection()
+        self.movie_projection = movie_projection
+        # Precomputed similar movies, see load_neighbours
+        self.neighbours = None
+        self.neighbour_scores = None
+        if quantize:
+            self.model = quantize_for_inference(model, half_embedding=not shared_tables)
+            if not shared_tables:
+                self.movie_projection = self.movie_projection.half()
 
-    # Build user embedding
-    with torch.no_grad():
-        movie_emb = model.movie_embedding(movie_tensor)
-        user_emb = (movie_emb * ratings_tensor.unsqueeze(1)).mean(dim=0, keepdim=True)
+    @classmethod
+    def from_files(cls, model_path=MODEL_PATH, ratings_csv_path=RATINGS_CSV_PATH, version=None):
+        print(f"📂 Loading recommender from {model_path}...")
+        model, movie_ids = load_model(model_path)
+        if movie_ids is None:
+            print("⚠️ Checkpoint has no movie vocabulary, rebuilding it from the ratings CSV")
+            movie_ids = load_movie_ids(ratings_csv_path)
+        print(f"✅ Recommender ready with {len(movie_ids)} movies")
+        version = version or f"{os.path.basename(model_path)}@{os.path.getmtime(model_path)}"
+        return cls(model, movie_ids, version=version, quantize=settings.RECOMMENDER_QUANTIZE)
 
-    # Build candidate list
-    candidate_movies = [m for m in movie_id_map.keys() if m not in valid_rated]
-    candidate_idx = torch.LongTensor([movie_id_map[m] for m in candidate_movies]).to(device)
+    @classmethod
+    def from_arrays(cls, array_dir, version):
+        print(f"📂 Mapping recommender arrays from {array_dir}...")
+        model, movie_ids, movie_projection = load_model_arrays(array_dir)
+        print(f"✅ Recommender ready with {len(movie_ids)} movies")
+        return cls(model, movie_ids, version=version, quantize=settings.RECOMMENDER_QUANTIZE,
+                   movie_projection=movie_projection)
 
-    predictions = []
-    model.eval()
+    @classmethod
+    def from_registry(cls, version=None):
+        """
+        Load a registry version (the current one by default), or the legacy
+        MODEL_PATH checkpoint when nothing has been published yet.
+        """
+        version = version or model_registry.current_version()
+        if version is None:
+            return cls.from_files()
+        directory = model_registry.version_dir(version)
+        if has_model_arrays(directory):
+            recommender = cls.from_arrays(directory, version)
+        else:
+            recommender = cls.from_files(model_registry.checkpoint_path(version), version=version)
+        if has_neighbours(directory):
+            recommender.load_neighbours(directory)
+        return recommender
+
+    def load_neighbours(self, directory):
+        """
+        Memory-map the similar-movie index written by export_neighbours.
+        """
+        self.neighbours = np.load(os.path.join(directory, "neighbours.npy"), mmap_mode="r")
+        self.neighbour_scores = np.load(os.path.join(directory, "neighbour_scores.npy"), mmap_mode="r")
+
+    def rows_for(self, movie_ids):
+        """
+        Map movieIds to embedding rows. Returns the rows and a boolean mask
+        telling which of the given movieIds are known to the model.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        pos = np.searchsorted(self.movie_ids, movie_ids, sorter=self._sorter)
+        rows = self._sorter[np.minimum(pos, self.num_movies - 1)]
+        known = self.movie_ids[rows] == movie_ids
+        return rows[known], known
+
+    def score(self, user_emb):
+        """
+        Score every movie for a user embedding of shape (dim,).
+        """
+        with torch.no_grad():
+            return self.model.score_all(user_emb, self.movie_projection)
+
+    def score_batch(self, user_embs):
+        """
+        Score every movie for a (users, dim) tensor of user embeddings.
+        Users are scored in chunks so the hidden activations stay below SCORE_CHUNK_BYTES.
+        """
+        row_bytes = self.movie_projection.numel() * 4  # activations are float32
+        chunk = max(1, SCORE_CHUNK_BYTES // row_bytes)
+        with torch.no_grad():
+            return torch.cat([
+                self.model.score_all(user_embs[i : i + chunk], self.movie_projection)
+                for i in range(0, len(user_embs), chunk)
+            ])
+
+    def score_rows(self, user_embs, rows):
+        """
+        Score only the given embedding rows for a (users, dim) tensor of user embeddings.
+        """
+        with torch.no_grad():
+            return self.model.score_all(user_embs, self.movie_projection[torch.as_tensor(rows, device=device)])
 
-    # Batched prediction for memory safety
-    print(f"🔮 Predicting scores for {len(candidate_idx)} movies (batch={batch_size})...")
-    with torch.no_grad():
-        for i in range(0, len(candidate_idx), batch_size):
-            batch = candidate_idx[i : i + batch_size]
-            preds = model(user_emb.repeat(len(batch), 1), batch)
-            predictions.append(preds.cpu())
-    predictions = torch.cat(predictions).numpy()
-
-    # Sort and select top-N
-    top_idx = predictions.argsort()[-top_n:][::-1]
-    top_movie_ids = [candidate_movies[i] for i in top_idx]
-
-    print("🎬 Top Recommendations:")
-    for i in top_idx:
-        mid = candidate_movies[i]
-        score = predictions[i]
+    def top_k_rows(self, scores, exclude_rows, k):
+        """
+        Return the k best scored embedding rows, skipping exclude_rows.
+        """
+        rated = torch.zeros(self.num_movies, dtype=torch.bool, device=scores.device)
+        rated[torch.as_tensor(exclude_rows, dtype=torch.long, device=scores.device)] = True
+        k = min(k, self.num_movies - int(rated.sum()))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        return torch.topk(scores.masked_fill(rated, float("-inf")), k).indices.cpu().numpy()
+
+    def top_k(self, scores, exclude_rows, k):
+        """
+        Return the movieIds of the k best scored rows, skipping exclude_rows.
+        """
+        return self.movie_ids[self.top_k_rows(scores, exclude_rows, k)].tolist()
+
+    def top_k_batch(self, scores, exclude_rows, k):
+        """
+        top_k for a (users, movies) score matrix with one exclude list per user.
+        """
+        rated = torch.zeros(scores.shape, dtype=torch.bool, device=scores.device)
+        for i, rows in enumerate(exclude_rows):
+            rated[i, torch.as_tensor(rows, dtype=torch.long, device=scores.device)] = True
+        k = min(k, self.num_movies)
+        top = torch.topk(scores.masked_fill(rated, float("-inf")), k)
+        top_rows = top.indices.cpu().numpy()
+        valid = torch.isfinite(top.values).cpu().numpy()
+        return [self.movie_ids[r[v]].tolist() for r, v in zip(top_rows, valid)]
+
+    def similar(self, movie_id, k=10):
+        """
+        The k movies most similar to movie_id as (movieId, cosine similarity)
+        pairs, best first. Read from the precomputed index when there is one,
+        otherwise computed with a scan of the embedding table.
+        """
+        rows, _ = self.rows_for([movie_id])
+        if not len(rows):
+            return []
+        row = rows[0]
+        if self.neighbours is not None:
+            neighbour_rows = self.neighbours[row, :k]
+            scores = self.neighbour_scores[row, :k].astype(np.float32)
+        else:
+            with torch.no_grad():
+                embeddings = self.model.movie_embedding.weight.float()
+                sims = torch.nn.functional.cosine_similarity(embeddings, embeddings[row].unsqueeze(0))
+                sims[row] = float("-inf")
+                top = torch.topk(sims, min(k, self.num_movies - 1))
+            neighbour_rows, scores = top.indices.cpu().numpy(), top.values.cpu().numpy()
+        return list(zip(self.movie_ids[neighbour_rows].tolist(), scores.tolist()))
+
+    def movie_vectors(self, rows):
+        """
+        Embedding rows as a numpy array of shape (len(rows), dim).
+        """
+        with torch.no_grad():
+            return self.model.movie_embedding.weight[torch.as_tensor(rows, device=device)].cpu().numpy()
+
+    def taste_sum(self, user_ratings_dict):
+        """
+        Rating-weighted sum of the embeddings of the rated movies known to the
+        model, and how many such movies there were.
+        """
+        rows, known = self.rows_for(list(user_ratings_dict.keys()))
+        ratings = np.asarray(list(user_ratings_dict.values()), dtype=np.float64)[known]
+        return ratings @ self.movie_vectors(rows).astype(np.float64), len(rows)
+
+    def user_embedding(self, user_ratings_dict):
+        """
+        Mean of the rating-weighted embeddings of the rated movies.
+        """
+        embedding_sum, count = self.taste_sum(user_ratings_dict)
+        if not count:
+            raise ValueError("No valid rated movies found in dataset.")
+        return embedding_sum / count
+
+    def recommend(self, user_ratings_dict, top_n=10):
+        """
+        Recommend movies for a user based on their {movieId: rating} history.
+        """
+        return self.recommend_for_embedding(self.user_embedding(user_ratings_dict), user_ratings_dict.keys(), top_n)
+
+    def recommend_for_embedding(self, user_emb, rated_movie_ids, top_n=10):
+        """
+        Recommend movies for a precomputed user embedding, skipping rated_movie_ids.
+        """
+        user_emb = torch.as_tensor(np.asarray(user_emb, dtype=np.float32), device=device)
+        rows, _ = self.rows_for(list(rated_movie_ids))
+        return self.top_k(self.score(user_emb), rows, top_n)
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+
+
+def get_recommender():
+    """
+    Return the process-wide recommender, loading it on first use.
+    Callers keep the object they got for the whole request, so a hot reload
+    never changes the model under an in-flight request.
+    """
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                _recommender = Recommender.from_registry()
+                if settings.MODEL_RELOAD_INTERVAL > 0:
+                    threading.Thread(target=_watch_registry, name="model-reloader", daemon=True).start()
+    return _recommender
+
+
+def _watch_registry():
+    """
+    Poll the registry's CURRENT pointer and swap in new versions. The new
+    model is loaded in this thread; the swap is a single reference assignment.
+    """
+    global _recommender
+    while True:
+        time.sleep(settings.MODEL_RELOAD_INTERVAL)
         try:
-            m = Movie.objects.get(movieId=mid)
-            print(f"{m.title} : {score:.3f}")
-        except Movie.DoesNotExist:
-            print(f"MovieID {mid} : {score:.3f} (not in DB)")
+            version = model_registry.current_version()
+            if version is not None and version != _recommender.version:
+                _recommender = Recommender.from_registry(version)
+                print(f"🔄 Switched to model version {version}")
+        except Exception as e:
+            print(f"❌ Model reload failed: {e}")
 
-    return top_movie_ids
+
+# ------------------ Recommend function ------------------
+def recommend_movies(user_ratings_dict, top_n=10):
+    """
+    Recommend movies for a new user based on their {movieId: rating} history.
+    """
+    return get_recommender().recommend(user_ratings_dict, top_n=top_n)
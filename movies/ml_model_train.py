@@ -1,17 +1,26 @@
+import contextlib
 import os
-import pandas as pd
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
-from sklearn.model_selection import train_test_split
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset
 from django.conf import settings
 
+from . import model_registry
+from .ratings_store import RatingsStore, filtered_ratings_store
+
 
 # ---- Dataset ----
 class MovieRatingDataset(Dataset):
     def __init__(self, df):
-        self.movies = torch.LongTensor(df['movie_idx'].values)
-        self.ratings = torch.FloatTensor(df['rating'].values)
+        self.movies = torch.tensor(np.asarray(df['movie_idx']), dtype=torch.long)
+        self.ratings = torch.tensor(np.asarray(df['rating']), dtype=torch.float32)
 
     def __len__(self):
         return len(self.ratings)
@@ -20,6 +29,83 @@ class MovieRatingDataset(Dataset):
         return self.movies[idx], self.ratings[idx]
 
 
+def movie_vocabulary(movie_column, chunk_size=1_000_000):
+    """
+    Sorted distinct movieIds of a (possibly memory-mapped) column, read in
+    chunks so memory is bounded by the vocabulary, not the number of ratings.
+    """
+    vocabulary = np.empty(0, dtype=movie_column.dtype)
+    for start in range(0, len(movie_column), chunk_size):
+        vocabulary = np.union1d(vocabulary, movie_column[start : start + chunk_size])
+    return vocabulary
+
+
+class ShardedBatchLoader:
+    """
+    Streams (movie rows, ratings) batches from memory-mapped rating columns,
+    or the ChainedColumns of a whole ratings store.
+
+    The ratings are cut into blocks of block_size rows. Every epoch the block
+    order is shuffled and consecutive blocks are gathered into shards of about
+    shard_size rows, so a shard mixes ratings from all over the file. Each
+    shard is shuffled and sliced into whole batch tensors: there is no
+    per-sample __getitem__ or collate call, and at most one shard is in
+    memory at a time.
+
+    For data-parallel training every rank builds a loader with the same seed
+    and its own rank; each epoch the ranks read disjoint sets of blocks.
+    """
+
+    def __init__(self, movie_column, rating_column, movie_ids, batch_size=256,
+                 shard_size=1_000_000, block_size=65_536, seed=0, rank=0, world_size=1):
+        self.movie_column = movie_column
+        self.rating_column = rating_column
+        # Sorted movieIds; a rating's embedding row is its movieId's position
+        self.movie_ids = movie_ids
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.blocks_per_shard = max(1, shard_size // block_size)
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        # Ratings read per epoch; with several ranks, each reads about this many
+        self.num_samples = -(-len(rating_column) // world_size)
+        self._rng = np.random.default_rng((seed, rank))
+
+    def __len__(self):
+        return -(-self.num_samples // self.batch_size)
+
+    def shards(self):
+        """
+        Shuffled (movie rows, ratings) tensors of one shard at a time.
+        """
+        num_blocks = -(-len(self.rating_column) // self.block_size)
+        # Same block order on every rank, from (seed, epoch) only
+        order = np.random.default_rng((self.seed, self.epoch)).permutation(num_blocks)[self.rank :: self.world_size]
+        self.epoch += 1
+        for first in range(0, len(order), self.blocks_per_shard):
+            blocks = np.sort(order[first : first + self.blocks_per_shard])  # sequential reads
+            slices = [slice(b * self.block_size, (b + 1) * self.block_size) for b in blocks]
+            movies = np.concatenate([self.movie_column[s] for s in slices])
+            ratings = np.concatenate([self.rating_column[s] for s in slices])
+            shuffle = self._rng.permutation(len(ratings))
+            rows = np.searchsorted(self.movie_ids, movies[shuffle])
+            yield torch.from_numpy(rows.astype(np.int64)), torch.from_numpy(ratings[shuffle].astype(np.float32))
+
+    def __iter__(self):
+        # A shard's tail is carried into the next shard, so every batch is full but the last
+        carry_movies, carry_ratings = torch.empty(0, dtype=torch.long), torch.empty(0)
+        for movies, ratings in self.shards():
+            movies, ratings = torch.cat((carry_movies, movies)), torch.cat((carry_ratings, ratings))
+            full = len(ratings) - len(ratings) % self.batch_size
+            for start in range(0, full, self.batch_size):
+                yield movies[start : start + self.batch_size], ratings[start : start + self.batch_size]
+            carry_movies, carry_ratings = movies[full:], ratings[full:]
+        if len(carry_ratings):
+            yield carry_movies, carry_ratings
+
+
 # ---- Neural Collaborative Filtering Model ----
 class NCF(nn.Module):
     def __init__(self, num_movies, embedding_dim=50):
@@ -39,65 +125,315 @@ class NCF(nn.Module):
         x = torch.cat([user_emb, movie_emb], dim=1)
         return self.fc_layers(x).squeeze()
 
+    # ---- Fast inference path ----
+    # The first Linear layer acts on [user_emb, movie_emb], so it splits into
+    # W_user @ user_emb + W_movie @ movie_emb + b. The movie half does not
+    # depend on the user and is computed once per model load.
+    def movie_projection(self):
+        first = self.fc_layers[0]
+        dim = self.movie_embedding.embedding_dim
+        return self.movie_embedding.weight @ first.weight[:, dim:].T + first.bias
+
+    def score_all(self, user_emb, movie_projection):
+        """
+        Score every movie for user_emb of shape (dim,) or (users, dim).
+        Returns (num_movies,) or (users, num_movies); matches forward() in eval mode.
+        """
+        first = self.fc_layers[0]
+        dim = self.movie_embedding.embedding_dim
+        user_proj = user_emb @ first.weight[:, :dim].T
+        x = torch.relu(movie_projection + user_proj.unsqueeze(-2))
+        return self.fc_layers[3:](x).squeeze(-1)
+
+
+# ---- Memory-mapped export ----
+# Catalog-sized tables as .npy files that every worker process maps
+# read-only, so they share the same page cache pages.
+MODEL_ARRAY_FILES = ("movie_ids.npy", "movie_embedding.npy", "movie_projection.npy", "fc_layers.pth")
+
+
+def export_model_arrays(model, movie_ids, out_dir):
+    model.eval()
+    with torch.no_grad():
+        np.save(os.path.join(out_dir, "movie_ids.npy"), np.asarray(movie_ids, dtype=np.int32))
+        np.save(os.path.join(out_dir, "movie_embedding.npy"), model.movie_embedding.weight.cpu().numpy())
+        np.save(os.path.join(out_dir, "movie_projection.npy"), model.movie_projection().cpu().numpy())
+    torch.save({
+        'fc_layers_state_dict': model.fc_layers.state_dict(),
+        'embedding_dim': model.movie_embedding.embedding_dim,
+    }, os.path.join(out_dir, "fc_layers.pth"))
+
+
+def has_model_arrays(directory):
+    return all(os.path.isfile(os.path.join(directory, name)) for name in MODEL_ARRAY_FILES)
+
+
+NEIGHBOUR_FILES = ("neighbours.npy", "neighbour_scores.npy")
+# Upper bound for the (block, movies) similarity matrix of one block
+NEIGHBOUR_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def compute_neighbours(embeddings, k=50):
+    """
+    Top-k cosine neighbours of every row of embeddings, best first.
+    Rows are compared block by block, so memory stays below NEIGHBOUR_BLOCK_BYTES
+    whatever the catalog size. Returns (rows int32, similarities float16).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.maximum(norms, 1e-12)
+    num_movies = len(unit)
+    k = min(k, num_movies - 1)
+    if k <= 0:
+        # A one-movie catalog has no neighbours
+        return np.empty((num_movies, 0), dtype=np.int32), np.empty((num_movies, 0), dtype=np.float16)
+    block = max(1, NEIGHBOUR_BLOCK_BYTES // (num_movies * 4))
+
+    neighbours = np.empty((num_movies, k), dtype=np.int32)
+    scores = np.empty((num_movies, k), dtype=np.float16)
+    for start in range(0, num_movies, block):
+        sims = unit[start : start + block] @ unit.T
+        rows = np.arange(len(sims))
+        sims[rows, start + rows] = -np.inf  # a movie is not its own neighbour
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        neighbours[start : start + block] = np.take_along_axis(top, order, axis=1)
+        scores[start : start + block] = np.take_along_axis(top_sims, order, axis=1)
+    return neighbours, scores
+
+
+def export_neighbours(embeddings, out_dir, k=None):
+    """
+    Precompute the similar movies of every embedding row next to the model arrays.
+    neighbours.npy holds embedding rows, so it maps through movie_ids.npy.
+    """
+    k = settings.SIMILAR_MOVIES_K if k is None else k
+    neighbours, scores = compute_neighbours(embeddings, k)
+    np.save(os.path.join(out_dir, "neighbours.npy"), neighbours)
+    np.save(os.path.join(out_dir, "neighbour_scores.npy"), scores)
+
+
+def has_neighbours(directory):
+    return all(os.path.isfile(os.path.join(directory, name)) for name in NEIGHBOUR_FILES)
+
 
 # ---- Training Function ----
-def train_model(epochs=20, batch_size=256, lr=0.005, embedding_dim=50):
-    ratings_csv_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "filtered_ratings.csv")
-    save_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "ml_model_ncf_full.pth")
+def publish_model(model, movie_ids, num_ratings, trained_until, **extra):
+    """
+    Save model together with the movieId of every embedding row, so inference
+    never has to re-read the ratings to rebuild the mapping. It is published
+    as a new registry version that serving processes hot-reload.
+    trained_until is the newest rating timestamp the model has seen, the
+    watermark fine_tune_model starts from.
+    """
+    version = model_registry.create_version()
+    save_path = model_registry.checkpoint_path(version)
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'num_movies': len(movie_ids),
+        'embedding_dim': model.movie_embedding.embedding_dim,
+        'movie_ids': torch.from_numpy(np.asarray(movie_ids, dtype=np.int32)),
+        'num_ratings': num_ratings,
+        'trained_at': datetime.now(timezone.utc).isoformat(),
+        'trained_until': trained_until,
+        **extra,
+    }, save_path)
+    export_model_arrays(model, movie_ids, model_registry.version_dir(version))
+    export_neighbours(model.movie_embedding.weight.detach().cpu().numpy(), model_registry.version_dir(version))
+    model_registry.set_current(version)
+    model_registry.garbage_collect()
+    print(f"Model saved to {save_path}")
+    return version
 
-    # --- Load dataset safely ---
-    # Read only the needed columns
-    cols = ['userId', 'movieId', 'rating', 'timestamp']
-    try:
-        data = pd.read_csv(ratings_csv_path, usecols=cols)
-    except Exception as e:
-        print("Error reading CSV:", e)
-        return None, None
-    print("csv reading completed")
-    # Drop duplicate ratings for the same user/movie (keep latest)
-    #data = data.sort_values('timestamp').drop_duplicates(['userId', 'movieId'], keep='last')
 
-    # Map movieId to indices
-    data['movie_idx'] = data['movieId'].astype('category').cat.codes
-    num_movies = data['movie_idx'].nunique()
-    print("num_movies", num_movies)
-    # Train/test split
-    train_loader = DataLoader(MovieRatingDataset(data), batch_size=batch_size, shuffle=True)
+def grow_movie_embedding(model, movie_ids, new_movie_ids):
+    """
+    Add embedding rows for movieIds not in the sorted movie_ids vocabulary.
+    The vocabulary stays sorted, so existing rows move to their new position;
+    new rows get nn.Embedding's default N(0, 1) initialisation.
+    Returns the grown vocabulary.
+    """
+    vocabulary = np.union1d(movie_ids, new_movie_ids).astype(np.int32)
+    if len(vocabulary) == len(movie_ids):
+        return movie_ids
+    old = model.movie_embedding.weight.detach()
+    weight = torch.randn(len(vocabulary), old.shape[1], dtype=old.dtype, device=old.device)
+    weight[torch.from_numpy(np.searchsorted(vocabulary, movie_ids)).to(old.device)] = old
+    model.movie_embedding = nn.Embedding.from_pretrained(weight, freeze=False)
+    return vocabulary
+
+
+def fine_tune_model(epochs=2, batch_size=256, lr=0.001, shard_size=1_000_000):
+    """
+    Warm-start the current model on the ratings newer than its watermark
+    instead of retraining from scratch. Movies seen for the first time get
+    new embedding rows. The result is published like a full training run.
+    """
+    version = model_registry.current_version()
+    if version is None:
+        print("No published model to fine-tune, run train_model first")
+        return None
+    checkpoint = torch.load(model_registry.checkpoint_path(version), map_location='cpu')
+    if checkpoint.get('movie_ids') is None:
+        print("The current model has no movie vocabulary, run train_model first")
+        return None
+    model = NCF(checkpoint['num_movies'], checkpoint.get('embedding_dim', 50))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    movie_ids = checkpoint['movie_ids'].numpy()
+    # Checkpoints older than the watermark fall back to their training time
+    watermark = checkpoint.get('trained_until')
+    if watermark is None:
+        watermark = int(datetime.fromisoformat(checkpoint['trained_at']).timestamp())
+
+    # In-app ratings reach the store through its append log; compacting first
+    # keeps only the newest rating of a movie re-rated since the watermark
+    store = filtered_ratings_store()
+    store.compact()
+    new = _ratings_after(store.columns(), watermark, shard_size)
+    if not len(new['rating']):
+        print(f"No ratings since {datetime.fromtimestamp(watermark, timezone.utc).isoformat()}, nothing to do")
+        return None
+    new_movies, new_ratings = new['movieId'], new['rating']
+    print(f"Fine-tuning version {version} on {len(new_ratings)} new ratings")
 
-    print("loding completed")
-    # Device
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    movie_ids = grow_movie_embedding(model, movie_ids, new_movies)
+    print("num_movies", len(movie_ids))
+    train_loader = ShardedBatchLoader(new_movies, new_ratings, movie_ids, batch_size, shard_size)
+    _fit(model, train_loader, epochs, lr, model.movie_embedding.embedding_dim, torch.device('cpu'))
 
-    # Model, loss, optimizer
-    model = NCF(num_movies, embedding_dim).to(device)
+    return publish_model(model, movie_ids, checkpoint.get('num_ratings', 0) + len(new_ratings),
+                         int(new['timestamp'].max()), fine_tuned_from=version)
+
+
+def _ratings_after(columns, watermark, chunk_size):
+    """
+    movieId, rating and timestamp of the ratings newer than watermark, read
+    from the store's columns chunk_size rows at a time.
+    """
+    names = ("movieId", "rating", "timestamp")
+    parts = {name: [np.empty(0, dtype=columns[name].dtype)] for name in names}
+    for chunk in zip(*(columns[name].chunks(chunk_size) for name in names)):
+        new = chunk[2] > watermark
+        for name, values in zip(names, chunk):
+            parts[name].append(values[new])
+    return {name: np.concatenate(values) for name, values in parts.items()}
+
+
+def _fit(model, train_loader, epochs, lr, embedding_dim, device, distributed=False, verbose=True):
+    """
+    The training loop. With distributed=True, model is wrapped in
+    DistributedDataParallel and the epoch loss is averaged over all ranks.
+    """
     criterion = nn.MSELoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    print("starting training")
-    # Training loop
     for epoch in range(epochs):
         model.train()
         train_loss = 0
+        seen = 0
         count=0
-        for movies, ratings in train_loader:
-            movies, ratings = movies.to(device), ratings.to(device)
-            user_emb = torch.zeros((movies.size(0), embedding_dim), device=device)
-            optimizer.zero_grad()
-            outputs = model(user_emb, movies)
-            loss = criterion(outputs, ratings)
-            loss.backward()
-            optimizer.step()
-            train_loss += loss.item() * movies.size(0)
-            count+=1
-            if count % 1000 == 0:
-                print("training loss: ", train_loss)
-        train_loss /= len(train_loader.dataset)
-        print(f"Epoch {epoch + 1}/{epochs}, Train Loss: {train_loss:.4f}")
-
-    # Save model
-    torch.save({
-        'model_state_dict': model.state_dict(),
-        'num_movies': num_movies
-    }, save_path)
-    print(f"Model saved to {save_path}")
+        # Ranks can get a block more or less than the others; join() lets the
+        # ranks that run out early keep answering the gradient all-reduces
+        with model.join() if distributed else contextlib.nullcontext():
+            for movies, ratings in train_loader:
+                movies, ratings = movies.to(device), ratings.to(device)
+                user_emb = torch.zeros((movies.size(0), embedding_dim), device=device)
+                optimizer.zero_grad()
+                outputs = model(user_emb, movies)
+                loss = criterion(outputs, ratings)
+                loss.backward()
+                optimizer.step()
+                train_loss += loss.item() * movies.size(0)
+                seen += movies.size(0)
+                count+=1
+                if verbose and count % 1000 == 0:
+                    print("training loss: ", train_loss)
+        if distributed:
+            totals = torch.tensor([train_loss, seen], dtype=torch.float64)
+            dist.all_reduce(totals)
+            train_loss, seen = totals.tolist()
+        train_loss /= max(seen, 1)
+        if verbose:
+            print(f"Epoch {epoch + 1}/{epochs}, Train Loss: {train_loss:.4f}")
+
+
+def _train_worker(rank, world_size, init_method, store_path, movie_ids, config, state_path):
+    """
+    One data-parallel training process. Every rank streams its own blocks of
+    the memory-mapped ratings; rank 0 saves the trained weights.
+    """
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        # Split the cores between the ranks instead of oversubscribing them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        torch.manual_seed(0)
+        data = RatingsStore(store_path).columns()
+        train_loader = ShardedBatchLoader(data['movieId'], data['rating'], movie_ids, config['batch_size'],
+                                          config['shard_size'], rank=rank, world_size=world_size)
+        model = DistributedDataParallel(NCF(len(movie_ids), config['embedding_dim']))
+        _fit(model, train_loader, config['epochs'], config['lr'], config['embedding_dim'],
+             torch.device('cpu'), distributed=True, verbose=rank == 0)
+        if rank == 0:
+            torch.save(model.module.state_dict(), state_path)
+    finally:
+        dist.destroy_process_group()
+
+
+def fit_ratings(store, movie_ids, epochs=20, batch_size=256, lr=0.005, embedding_dim=50,
+                shard_size=1_000_000, workers=1):
+    """
+    Train an NCF on a ratings store. With workers > 1 the training runs in
+    that many CPU processes with DistributedDataParallel over gloo; each
+    process uses batch_size, so the effective batch is workers * batch_size.
+    """
+    if workers <= 1:
+        data = store.columns()
+        # Streams shuffled batches from the memory-mapped segments and the log, one shard in memory at a time
+        train_loader = ShardedBatchLoader(data['movieId'], data['rating'], movie_ids, batch_size, shard_size)
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        model = NCF(len(movie_ids), embedding_dim).to(device)
+        _fit(model, train_loader, epochs, lr, embedding_dim, device)
+        return model
+
+    config = {'epochs': epochs, 'batch_size': batch_size, 'lr': lr,
+              'embedding_dim': embedding_dim, 'shard_size': shard_size}
+    with tempfile.TemporaryDirectory() as tmp:
+        state_path = os.path.join(tmp, "state.pth")
+        init_method = f"file://{os.path.join(tmp, 'rendezvous')}"
+        mp.spawn(_train_worker, args=(workers, init_method, store.path, movie_ids, config, state_path),
+                 nprocs=workers, join=True)
+        model = NCF(len(movie_ids), embedding_dim)
+        model.load_state_dict(torch.load(state_path))
+    return model
+
+
+def train_model(epochs=20, batch_size=256, lr=0.005, embedding_dim=50, shard_size=1_000_000, workers=None):
+    ratings_csv_path = os.path.join(settings.BASE_DIR, "movielens_dataset", "filtered_ratings.csv")
+
+    # --- Load dataset safely ---
+    store = filtered_ratings_store()
+    try:
+        # The MovieLens ratings come from filtered_ratings.csv, imported on the
+        # first run. A log of in-app ratings alone does not count as imported.
+        if not store.segments():
+            store.import_csv(ratings_csv_path)
+        # Drops deleted and superseded ratings, one userId range at a time
+        store.compact()
+        data = store.columns()
+    except Exception as e:
+        print("Error reading ratings:", e)
+        return None, None
+    print("ratings loading completed")
+
+    # Map movieId to indices
+    movie_ids = movie_vocabulary(data['movieId'])
+    num_movies = len(movie_ids)
+    print("num_movies", num_movies)
+
+    workers = settings.TRAIN_WORKERS if workers is None else workers
+    print(f"starting training with {workers} process(es)")
+    model = fit_ratings(store, movie_ids, epochs, batch_size, lr, embedding_dim, shard_size, workers)
 
+    trained_until = max((int(chunk.max()) for chunk in data['timestamp'].chunks(shard_size) if len(chunk)), default=0)
+    publish_model(model, movie_ids, len(data['rating']), trained_until)
     return model, data
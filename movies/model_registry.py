@@ -0,0 +1,114 @@
+"""
+Versioned NCF checkpoints under movielens_dataset/models/.
+
+Every training run publishes its checkpoint into its own version directory
+and then moves the CURRENT pointer to it. Serving processes watch CURRENT
+and swap in the new model without a restart.
+
+    movielens_dataset/models/
+        CURRENT                         <- name of the live version
+        20261018T064500123456Z/ml_model_ncf.pth
+        ...
+"""
+import os
+import shutil
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+REGISTRY_DIR = os.path.join(settings.BASE_DIR, "movielens_dataset", "models")
+CHECKPOINT_NAME = "ml_model_ncf.pth"
+CURRENT_FILE = "CURRENT"
+
+
+def new_version():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def version_dir(version, registry_dir=None):
+    registry_dir = registry_dir or REGISTRY_DIR
+    return os.path.join(registry_dir, version)
+
+
+def checkpoint_path(version, registry_dir=None):
+    registry_dir = registry_dir or REGISTRY_DIR
+    return os.path.join(version_dir(version, registry_dir), CHECKPOINT_NAME)
+
+
+def list_versions(registry_dir=None):
+    """
+    Published versions, oldest first.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(v for v in os.listdir(registry_dir) if os.path.isfile(checkpoint_path(v, registry_dir)))
+
+
+def current_version(registry_dir=None):
+    registry_dir = registry_dir or REGISTRY_DIR
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_current(version, registry_dir=None):
+    """
+    Point CURRENT at a published version. The pointer is replaced atomically,
+    so readers see either the old or the new version, never a partial write.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    if not os.path.isfile(checkpoint_path(version, registry_dir)):
+        raise ValueError(f"Model version {version} is not published")
+    tmp_path = os.path.join(registry_dir, f".{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(registry_dir, CURRENT_FILE))
+
+
+def create_version(registry_dir=None):
+    """
+    Create an empty version directory and return its name. Files written into
+    it are not served until the version is passed to set_current.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    version = new_version()
+    os.makedirs(version_dir(version, registry_dir))
+    return version
+
+
+def publish_checkpoint(path, registry_dir=None):
+    """
+    Copy an existing checkpoint into a new version, export its memory-mapped
+    arrays and similar-movie index, and make it current.
+    """
+    from .ml_model import load_model
+    from .ml_model_train import export_model_arrays, export_neighbours
+
+    registry_dir = registry_dir or REGISTRY_DIR
+    model, movie_ids = load_model(path)
+    if movie_ids is None:
+        raise ValueError(f"{path} has no movie vocabulary, retrain it before publishing")
+    version = create_version(registry_dir)
+    shutil.copyfile(path, checkpoint_path(version, registry_dir))
+    export_model_arrays(model, movie_ids, version_dir(version, registry_dir))
+    export_neighbours(model.movie_embedding.weight.detach().cpu().numpy(), version_dir(version, registry_dir))
+    set_current(version, registry_dir)
+    garbage_collect(registry_dir=registry_dir)
+    return version
+
+
+def garbage_collect(keep=None, registry_dir=None):
+    """
+    Delete all but the newest `keep` versions. The current version is always kept.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    keep = settings.MODEL_REGISTRY_KEEP if keep is None else keep
+    current = current_version(registry_dir)
+    old_versions = list_versions(registry_dir)[:-keep] if keep > 0 else list_versions(registry_dir)
+    for version in old_versions:
+        if version != current:
+            shutil.rmtree(version_dir(version, registry_dir), ignore_errors=True)
+            print(f"🗑️ Removed model version {version}")
@@ -1,5 +1,6 @@
 
 from django.db import models
+from django.db.models import Count, Max
 
 from users.models import CustomUser
 from csv import writer
@@ -37,6 +38,21 @@ class SpokenLanguage(models.Model):
         return self.name
 
 # --- Movie Table ---
+class MovieQuerySet(models.QuerySet):
+    def active(self):
+        """
+        Movies still in the source catalog; retired ones are kept for their ratings and polls.
+        """
+        return self.filter(retired_at__isnull=True)
+
+    def version(self):
+        """
+        Changes whenever an import or sync writes or retires a movie, so serving
+        processes can tell their in-memory catalog indexes are stale.
+        """
+        stats = self.aggregate(count=Count('id'), synced=Max('synced_at'))
+        return stats['count'], stats['synced']
+
 class Movie(models.Model):
     tmdb_id = models.BigIntegerField(unique=True)
     movieId = models.IntegerField(null=True, blank=True)  # from MovieLens
@@ -58,6 +74,9 @@ class Movie(models.Model):
     poster_path = models.URLField( null=True, blank=True)
     backdrop_path = models.URLField( null=True, blank=True)
     homepage = models.URLField(null=True, blank=True)
+    source_hash = models.CharField(max_length=40, null=True, blank=True)  # of the imported TMDB row
+    retired_at = models.DateTimeField(null=True, blank=True)  # set when the title left the catalog
+    synced_at = models.DateTimeField(null=True, blank=True, db_index=True)  # last written by an import or sync
 
     # --- Many-to-Many Relationships ---
     genres = models.ManyToManyField(Genre, related_name='movies')
@@ -66,6 +85,8 @@ class Movie(models.Model):
     production_countries = models.ManyToManyField(ProductionCountry, related_name='movies')
     spoken_languages = models.ManyToManyField(SpokenLanguage, related_name='movies')
 
+    objects = MovieQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -79,6 +100,21 @@ class Rating(models.Model):
     def __str__(self):
         return f"{self.user} → {self.movie.title} ({self.rating})"
 
+class UserTaste(models.Model):
+    """
+    Running rating-weighted sum of the NCF embeddings of the movies a user
+    rated, so the user embedding is sum / count without reading their ratings.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='taste')
+    embedding_sum = models.BinaryField()  # float64 array of the embedding size
+    rating_count = models.IntegerField(default=0)  # ratings of movies known to the model
+    model_version = models.CharField(max_length=500)
+    ratings_checksum = models.CharField(max_length=200, blank=True, default='')  # of the ratings it was built from
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} ({self.rating_count} ratings)"
+
 class Comments(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='comments',null=False,blank=False)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='comments',null=False,blank=False)
@@ -0,0 +1,210 @@
+"""
+Offline top-N recommendations for every user with ratings.
+
+The precompute_recommendations command scores all users with a process
+pool and writes one snapshot:
+
+    movielens_dataset/recommendations/
+        recommendations.json                    <- live snapshot and its metadata
+        recommendations-20261018T064500Z.npy    <- int32 (users, 2 + top_n)
+
+Row i of the array is [userId, ratings count, movieId, movieId, ...] padded
+with -1 and rows are sorted by userId, so a lookup is a binary search in a
+memory map. The count is how many ratings the user had when the snapshot was
+taken, so a deleted rating shows up as a lower count.
+"""
+import json
+import multiprocessing
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+
+SNAPSHOT_DIR = os.path.join(settings.BASE_DIR, "movielens_dataset", "recommendations")
+SNAPSHOT_META = "recommendations.json"
+# Bumped when the table layout changes; snapshots of another format are ignored
+SNAPSHOT_FORMAT = 2
+
+# ------------------ Precompute (worker processes) ------------------
+_worker_recommender = None
+
+
+def _init_worker(version):
+    """
+    Load the model version once per worker. Its tables are memory-mapped,
+    so all workers share the same pages.
+    """
+    global _worker_recommender
+    import django
+    django.setup()
+    import torch
+    from .ml_model import Recommender
+
+    torch.set_num_threads(1)
+    _worker_recommender = Recommender.from_registry(version)
+
+
+def _score_block(block, top_n):
+    """
+    Snapshot rows for a block of (userId, ratings count, movieIds, ratings)
+    users, scored as one (users, movies) matrix product. Users with no movie
+    known to the model are dropped.
+    """
+    import torch
+    from .ml_model import device
+
+    recommender = _worker_recommender
+    embeddings = np.zeros((len(block), recommender.model.movie_embedding.embedding_dim), dtype=np.float32)
+    exclude_rows, user_ids = [], []
+    for i, (user_id, _, movie_ids, ratings) in enumerate(block):
+        rows, known = recommender.rows_for(movie_ids)
+        if len(rows):
+            embeddings[i] = ratings[known] @ recommender.movie_vectors(rows) / len(rows)
+        exclude_rows.append(rows)
+        user_ids.append(user_id if len(rows) else -1)
+
+    scores = recommender.score_batch(torch.as_tensor(embeddings, device=device))
+    out = np.full((len(block), 2 + top_n), -1, dtype=np.int32)
+    out[:, 0] = user_ids
+    out[:, 1] = [num_ratings for _, num_ratings, _, _ in block]
+    for i, movie_ids in enumerate(recommender.top_k_batch(scores, exclude_rows, top_n)):
+        out[i, 2 : 2 + len(movie_ids)] = movie_ids
+    return out[out[:, 0] >= 0]
+
+
+def precompute_recommendations(top_n=50, workers=None, block_size=256, snapshot_dir=None):
+    """
+    Score every user with ratings against the current model version and
+    publish the result as the live snapshot. Returns the snapshot metadata.
+    """
+    from django.db.models import Count
+
+    from . import model_registry
+    from .models import Rating
+
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    workers = workers or os.cpu_count() or 1
+    version = model_registry.current_version()
+    if version is None:
+        raise ValueError("No model version has been published yet.")
+
+    # Ratings written after this instant are not in the snapshot
+    created_at = datetime.now(timezone.utc)
+    # Counted before the ratings are read: a rating deleted in between leaves
+    # the stored count too high, which only makes the user's row look stale
+    num_ratings = dict(Rating.objects.values('user_id').annotate(count=Count('id')).values_list('user_id', 'count'))
+    ratings = np.array(
+        Rating.objects.filter(movie__movieId__isnull=False)
+                      .order_by('user_id')
+                      .values_list('user_id', 'movie__movieId', 'rating'),
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    user_ids, starts = np.unique(ratings[:, 0].astype(np.int64), return_index=True)
+    users = [
+        (int(user_id), num_ratings.get(int(user_id), 0), ratings[start:end, 1].astype(np.int64), ratings[start:end, 2])
+        for user_id, start, end in zip(user_ids, starts, list(starts[1:]) + [len(ratings)])
+    ]
+    blocks = [users[i : i + block_size] for i in range(0, len(users), block_size)]
+    print(f"🧮 Scoring {len(users)} users in {len(blocks)} blocks with {workers} workers...")
+
+    # spawn, not fork: the parent's torch thread pool does not survive a fork
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(version,)) as pool:
+        results = pool.starmap(_score_block, [(block, top_n) for block in blocks])
+    table = np.concatenate(results) if results else np.empty((0, 2 + top_n), dtype=np.int32)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"recommendations-{created_at.strftime('%Y%m%dT%H%M%S%fZ')}.npy"
+    np.save(os.path.join(snapshot_dir, name), table)
+    meta = {
+        "file": name,
+        "format": SNAPSHOT_FORMAT,
+        "created_at": created_at.isoformat(),
+        "model_version": version,
+        "top_n": top_n,
+        "num_users": len(table),
+    }
+    tmp_path = os.path.join(snapshot_dir, f".{SNAPSHOT_META}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(snapshot_dir, SNAPSHOT_META))
+
+    for old in os.listdir(snapshot_dir):
+        if old.startswith("recommendations-") and old != name:
+            os.remove(os.path.join(snapshot_dir, old))
+    print(f"✅ Precomputed recommendations for {len(table)} users")
+    return meta
+
+
+# ------------------ Serving ------------------
+class Snapshot:
+    def __init__(self, snapshot_dir, meta):
+        self.meta = meta
+        self.created_at = datetime.fromisoformat(meta["created_at"])
+        self.model_version = meta["model_version"]
+        # Readers keep the file mapped; on Linux a replaced file stays readable
+        self.table = np.load(os.path.join(snapshot_dir, meta["file"]), mmap_mode="r")
+
+    def get(self, user_id):
+        """
+        The ratings count and precomputed movieIds of a user, or None when they
+        are not in the snapshot.
+        """
+        i = np.searchsorted(self.table[:, 0], user_id)
+        if i == len(self.table) or self.table[i, 0] != user_id:
+            return None
+        row = self.table[i, 2:]
+        return int(self.table[i, 1]), row[row >= 0].tolist()
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(snapshot_dir=None):
+    """
+    The live snapshot, or None. The metadata file is re-read on every call
+    (a small stat and read) so a new snapshot is picked up without a restart.
+    """
+    global _snapshot
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    try:
+        with open(os.path.join(snapshot_dir, SNAPSHOT_META), encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if meta.get("format") != SNAPSHOT_FORMAT:
+        # Written before the ratings count was stored; precompute again to use it
+        return None
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.meta != meta:
+            _snapshot = Snapshot(snapshot_dir, meta)
+        return _snapshot
+
+
+def get_precomputed_recommendations(user_id, top_n=50):
+    """
+    A user's top_n precomputed recommendations, or None when there is no
+    snapshot for the serving model version, it keeps fewer than top_n per
+    user, the user is not in it, or their ratings changed since it was taken.
+    """
+    from django.db.models import Count, Max
+
+    from .ml_model import get_recommender
+    from .models import Rating
+
+    snapshot = get_snapshot()
+    if snapshot is None or snapshot.model_version != get_recommender().version or snapshot.meta["top_n"] < top_n:
+        return None
+    entry = snapshot.get(user_id)
+    if entry is None:
+        return None
+    num_ratings, recommended_ids = entry
+    # A new or changed rating has a later timestamp; a deleted one lowers the count
+    current = Rating.objects.filter(user_id=user_id).aggregate(count=Count('id'), latest=Max('timestamp'))
+    changed = current["count"] != num_ratings or (
+        current["latest"] is not None and current["latest"] > snapshot.created_at
+    )
+    return None if changed else recommended_ids[:top_n]
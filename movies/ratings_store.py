@@ -0,0 +1,325 @@
+"""
+Columnar ratings store replacing the ratings CSVs.
+
+    movielens_dataset/ratings_store/filtered/
+        MANIFEST                      <- JSON list of the live segments
+        seg-<ns>/userId.npy           <- int32
+        seg-<ns>/movieId.npy          <- int32
+        seg-<ns>/rating.npy           <- float32
+        seg-<ns>/timestamp.npy        <- int64, seconds
+        append.log                    <- packed records of new in-app ratings
+
+Segments are immutable and memory-mapped on load; columns() chains them
+with the log so training streams the whole store without copying it. New
+ratings are appended to the log with one O_APPEND write each. compact(),
+run before every training and fine-tuning, folds the log into the segments
+keeping only the newest rating of every (userId, movieId), one userId range
+at a time.
+
+MovieLens users keep their positive userIds and in-app users are negated
+(app_user_id), so the two never collide in one store.
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+STORE_ROOT = os.path.join(settings.BASE_DIR, "movielens_dataset", "ratings_store")
+MANIFEST_FILE = "MANIFEST"
+LOG_FILE = "append.log"
+
+COLUMNS = {
+    "userId": np.dtype("<i4"),
+    "movieId": np.dtype("<i4"),
+    "rating": np.dtype("<f4"),
+    "timestamp": np.dtype("<i8"),
+}
+# One append log record; a NaN rating is a tombstone for a deleted rating
+LOG_RECORD = np.dtype(list(COLUMNS.items()))
+# Ratings per userId range merged by compact(), and so per compacted segment
+COMPACT_CHUNK_ROWS = 5_000_000
+
+
+def app_user_id(user_id):
+    """
+    Store id of an in-app user. Negated so it never collides with a MovieLens userId.
+    """
+    return -int(user_id)
+
+
+def _concat(parts):
+    return {column: np.concatenate([p[column] for p in parts]) if parts else np.empty(0, dtype)
+            for column, dtype in COLUMNS.items()}
+
+
+class ChainedColumn:
+    """
+    One column over several arrays (the segments and the log), read in
+    contiguous slices without concatenating the whole column.
+    """
+
+    def __init__(self, parts, dtype):
+        self.parts = parts
+        self.dtype = dtype
+        self._offsets = np.cumsum([0] + [len(part) for part in parts])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise IndexError("ChainedColumn only supports contiguous slices")
+        first = max(0, np.searchsorted(self._offsets, start, side="right") - 1)
+        pieces = []
+        for part, offset in zip(self.parts[first:], self._offsets[first:]):
+            if offset >= stop:
+                break
+            pieces.append(part[max(0, start - offset) : stop - offset])
+        if not pieces:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(pieces) if len(pieces) > 1 else pieces[0]
+
+    def chunks(self, chunk_size=1_000_000):
+        for start in range(0, len(self), chunk_size):
+            yield self[start : start + chunk_size]
+
+
+class RatingsStore:
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def named(cls, name):
+        return cls(os.path.join(STORE_ROOT, name))
+
+    # ------------------ Layout ------------------
+    def segments(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _set_segments(self, segments):
+        tmp_path = os.path.join(self.path, f".{MANIFEST_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(segments, f)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE))
+
+    def _logs(self):
+        """
+        The live log and any log rotated away by a compaction that did not finish.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.startswith(LOG_FILE))
+
+    def exists(self):
+        return bool(self.segments() or self._logs())
+
+    # ------------------ Writes ------------------
+    def append(self, user_id, movie_id, rating, timestamp=None):
+        """
+        Append one rating to the log. A single write on an O_APPEND descriptor,
+        so concurrent writers from several processes never interleave records.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        record = np.array(
+            [(user_id, movie_id, np.nan if rating is None else rating, int(timestamp or time.time()))],
+            dtype=LOG_RECORD,
+        )
+        fd = os.open(os.path.join(self.path, LOG_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record.tobytes())
+        finally:
+            os.close(fd)
+
+    def write_segment(self, columns, replace=False):
+        """
+        Write the columns as a new segment and add it to the store, or make it
+        the only segment with replace=True (the log is kept either way).
+        """
+        name = self._new_segment(columns)
+        old_segments = self.segments()
+        self._set_segments([name] if replace else old_segments + [name])
+        if replace:
+            self._remove_segments(old_segments)
+        return name
+
+    def _new_segment(self, columns):
+        """
+        Write the columns as a segment directory, not yet in the manifest.
+        """
+        name = f"seg-{time.time_ns()}"
+        tmp_dir = os.path.join(self.path, f".{name}.tmp")
+        os.makedirs(tmp_dir)
+        for column, dtype in COLUMNS.items():
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), np.ascontiguousarray(columns[column], dtype=dtype))
+        os.rename(tmp_dir, os.path.join(self.path, name))
+        return name
+
+    def _remove_segments(self, segments):
+        for segment in segments:
+            shutil.rmtree(os.path.join(self.path, segment), ignore_errors=True)
+
+    def import_csv(self, csv_path, chunksize=1_000_000):
+        """
+        Replace the store's segments with a ratings CSV, read in typed chunks.
+        """
+        print(f"📥 Importing {csv_path} into the ratings store...")
+        chunks = pd.read_csv(csv_path, usecols=list(COLUMNS), dtype=COLUMNS, chunksize=chunksize)
+        parts = [{column: chunk[column].to_numpy() for column in COLUMNS} for chunk in chunks]
+        self.write_segment(_concat(parts), replace=True)
+        print(f"💾 Imported {sum(len(p['rating']) for p in parts)} ratings")
+
+    # ------------------ Reads ------------------
+    def _segment(self, segment):
+        return {column: np.load(os.path.join(self.path, segment, f"{column}.npy"), mmap_mode="r")
+                for column in COLUMNS}
+
+    def _read_log(self, log_path):
+        records = np.fromfile(log_path, dtype=np.uint8)
+        # Drop a record cut short by a crash mid-write
+        records = records[: len(records) - len(records) % LOG_RECORD.itemsize]
+        return records.view(LOG_RECORD)
+
+    def _parts(self):
+        """
+        The memory-mapped segments and the ratings of the log, in arrival order.
+        Re-rated and deleted ratings in the log only replace the older rows
+        once compact() has run.
+        """
+        parts = [self._segment(segment) for segment in self.segments()]
+        for log_path in self._logs():
+            records = self._read_log(log_path)
+            records = records[~np.isnan(records["rating"])]
+            if len(records):
+                parts.append({column: records[column] for column in COLUMNS})
+        return parts
+
+    def load(self):
+        """
+        All ratings as {column: array}. A store with one segment and an empty
+        log is returned memory-mapped; anything else is concatenated in memory.
+        """
+        parts = self._parts()
+        return parts[0] if len(parts) == 1 else _concat(parts)
+
+    def columns(self):
+        """
+        All ratings as {column: ChainedColumn}, for readers that stream the
+        store in slices: nothing is copied however many segments there are.
+        """
+        parts = self._parts()
+        return {column: ChainedColumn([part[column] for part in parts], dtype) for column, dtype in COLUMNS.items()}
+
+    def load_frame(self):
+        """
+        load() as a DataFrame with the typed columns.
+        """
+        return pd.DataFrame(self.load(), copy=False)
+
+    # ------------------ Compaction ------------------
+    def compact(self, chunk_rows=COMPACT_CHUNK_ROWS):
+        """
+        Merge every segment and the log into segments of about chunk_rows
+        rows, each holding the newest rating of every (userId, movieId) of a
+        userId range. Deleted ratings are dropped. Only one range is in
+        memory at a time, besides the log. Ratings appended while compacting
+        go to a fresh log and are kept.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        live_log = os.path.join(self.path, LOG_FILE)
+        if os.path.exists(live_log):
+            os.rename(live_log, f"{live_log}.{time.time_ns()}")
+        rotated = [log_path for log_path in self._logs() if log_path != live_log]
+
+        old_segments = self.segments()
+        parts = [self._segment(segment) for segment in old_segments]
+        # Log records come last, so they win timestamp ties with segment rows
+        parts += [{column: records[column] for column in COLUMNS}
+                  for records in map(self._read_log, rotated)]
+
+        new_segments, num_rows, num_kept = [], 0, 0
+        for low, high in _user_ranges(parts, chunk_rows):
+            columns = _concat([_rows_in_range(part, low, high, chunk_rows) for part in parts])
+            # Sorted by (userId, movieId, timestamp); the stable sort breaks timestamp ties by arrival order
+            order = np.lexsort((columns["timestamp"], columns["movieId"], columns["userId"]))
+            user, movie = columns["userId"][order], columns["movieId"][order]
+            last = np.ones(len(order), dtype=bool)
+            last[:-1] = (user[1:] != user[:-1]) | (movie[1:] != movie[:-1])
+            keep = order[last]
+            keep = keep[~np.isnan(columns["rating"][keep])]
+            if len(keep):
+                new_segments.append(self._new_segment({column: values[keep] for column, values in columns.items()}))
+            num_rows += len(order)
+            num_kept += len(keep)
+
+        self._set_segments(new_segments)
+        self._remove_segments(old_segments)
+        for log_path in rotated:
+            os.remove(log_path)
+        print(f"🗜️ Compacted {num_rows} rows into {num_kept} ratings in {len(new_segments)} segments")
+        return num_kept
+
+
+def _user_ranges(parts, chunk_rows):
+    """
+    [low, high) userId ranges holding about chunk_rows rows each, from the
+    row count of every userId. Memory is bounded by the number of users.
+    """
+    users, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    for part in parts:
+        for start in range(0, len(part["userId"]), chunk_rows):
+            chunk_users, chunk_counts = np.unique(part["userId"][start : start + chunk_rows], return_counts=True)
+            users, inverse = np.unique(np.concatenate((users, chunk_users)), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate((counts, chunk_counts)),
+                                 minlength=len(users)).astype(np.int64)
+    if not len(users):
+        return []
+    # A range starts at the first user whose rows begin in the next chunk_rows block
+    block = (np.cumsum(counts) - counts) // chunk_rows
+    lows = users[np.r_[0, np.flatnonzero(np.diff(block)) + 1]]
+    highs = np.r_[lows[1:], users[-1] + 1]
+    return list(zip(lows.tolist(), highs.tolist()))
+
+
+def _rows_in_range(part, low, high, chunk_rows):
+    """
+    The rows of a part with low <= userId < high, read chunk_rows at a time.
+    """
+    pieces = []
+    for start in range(0, len(part["userId"]), chunk_rows):
+        user = part["userId"][start : start + chunk_rows]
+        rows = start + np.flatnonzero((user >= low) & (user < high))
+        pieces.append({column: values[rows] for column, values in part.items()})
+    return _concat(pieces)
+
+def filtered_ratings_store():
+    """
+    The training ratings: filtered_ratings.csv, imported by train_model while
+    the store has no segment, plus the in-app ratings appended to its log.
+    """
+    return RatingsStore.named("filtered")
+
+
+def exported_ratings_store():
+    """
+    The ratings_small.csv ratings of the movies in the catalog, written by
+    export_filtered_ratings in place of filtered_ratings_small.csv. Training
+    does not read it.
+    """
+    return RatingsStore.named("filtered_small")
+
+
+def movielens_ratings_store():
+    """
+    The raw MovieLens ratings, imported once from ratings_small.csv.
+    """
+    return RatingsStore.named("movielens")
@@ -0,0 +1,66 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max
+
+from .models import Rating
+
+# LocMemCache evicts least recently used entries once MAX_ENTRIES is reached,
+# and every entry expires after the TIMEOUT configured in settings.CACHES.
+# Entries live in each worker process, but their keys carry a version read
+# from the database, so a rating saved through any worker invalidates them all.
+# Keys also carry the model version, so a hot reload invalidates them too.
+RECOMMENDATION_CACHE = "recommendations"
+
+
+def _cache():
+    return caches[RECOMMENDATION_CACHE]
+
+
+def _ratings_versions(user_ids):
+    """
+    {user_id: (rating count, latest rating timestamp)}. Rating.timestamp is
+    auto_now, so an added or changed rating moves the timestamp and a deleted
+    one lowers the count.
+    """
+    rows = (Rating.objects.filter(user_id__in=user_ids).values('user_id')
+                  .annotate(count=Count('id'), latest=Max('timestamp')))
+    return {row['user_id']: (row['count'], int(row['latest'].timestamp() * 1_000_000) if row['latest'] else 0)
+            for row in rows}
+
+
+def get_ratings_version(user_id):
+    """
+    Return the current ratings version of a user.
+    """
+    count, latest = _ratings_versions([user_id]).get(user_id, (0, 0))
+    return f"{count}-{latest}"  # safe in a cache key
+
+
+def get_cached_recommendations(user_id, version, model_version):
+    return _cache().get(f"recommendations:{model_version}:{user_id}:{version}")
+
+
+def set_cached_recommendations(user_id, version, model_version, movie_ids):
+    _cache().set(f"recommendations:{model_version}:{user_id}:{version}", movie_ids)
+
+
+# ------------------ Groups ------------------
+def get_group_version(group_id, member_ids):
+    """
+    Version of a group's recommendations. It changes when the membership
+    changes or when any member writes a rating.
+    """
+    versions = _ratings_versions(set(member_ids))
+    member_versions = sorted((user_id, versions.get(user_id, (0, 0))) for user_id in set(member_ids))
+    return hashlib.sha1(repr((group_id, member_versions)).encode()).hexdigest()
+
+
+def get_cached_group_recommendations(group_id, strategy, version, model_version):
+    return _cache().get(f"group_recommendations:{model_version}:{group_id}:{strategy}:{version}")
+
+
+def set_cached_group_recommendations(group_id, strategy, version, model_version, movie_ids):
+    _cache().set(f"group_recommendations:{model_version}:{group_id}:{strategy}:{version}", movie_ids,
+                 timeout=settings.GROUP_RECOMMENDATION_CACHE_TTL)
@@ -0,0 +1,33 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .helpers import append_rating
+from .models import Rating
+from .user_taste import apply_rating_change
+
+
+@receiver(pre_save, sender=Rating)
+def remember_old_rating(sender, instance, **kwargs):
+    instance._old_rating = None
+    if instance.pk is not None:
+        instance._old_rating = Rating.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, **kwargs):
+    apply_rating_change(instance.user_id, instance.movie_id, instance.movie.movieId,
+                        old_rating=instance._old_rating, new_rating=float(instance.rating))
+    if instance.movie.movieId is not None:
+        # Only logged once the rating is committed
+        transaction.on_commit(partial(append_rating, instance.user_id, instance.movie.movieId, float(instance.rating)))
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    apply_rating_change(instance.user_id, instance.movie_id, instance.movie.movieId, old_rating=float(instance.rating))
+    if instance.movie.movieId is not None:
+        transaction.on_commit(partial(append_rating, instance.user_id, instance.movie.movieId, None))
+
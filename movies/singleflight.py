@@ -0,0 +1,55 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs the
+    computation and every caller that arrives while it is running awaits the
+    same result. Works across threads and event loops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    async def run(self, key, fn):
+        """
+        Await fn() for key, or the result of an fn() already running for key.
+        Waiters share the leader's result or exception; if the leader is
+        cancelled, one of them runs fn() instead.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            try:
+                # Shielded, so a waiter being cancelled leaves the shared call alone
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The leader was cancelled before it finished; run fn again
+            return await self.run(key, fn)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            # Forgotten before it is resolved, so a retrying waiter starts a new call
+            self._forget(key)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                # Cancelled, e.g. the client disconnected
+                future.cancel()
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key):
+        with self._lock:
+            del self._calls[key]
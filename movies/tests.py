@@ -1,3 +1,672 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import torch
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import catalog_preprocess, evaluation, helpers, ml_model_train, precomputed, user_taste, views
+from .batching import BatchScheduler
+from .benchmarks import synthetic_recommender
+from .content_recommender import ContentRecommender
+from .evaluation import holdout_split
+from .group_recommender import recommend_for_group
+from .ml_model import Recommender
+from .ml_model_train import NCF, ShardedBatchLoader, compute_neighbours, grow_movie_embedding, movie_vocabulary
+from .models import Movie, Rating, UserTaste
+from .ratings_store import LOG_FILE, RatingsStore
+from .recommendation_cache import (
+    get_cached_group_recommendations, get_cached_recommendations, get_group_version, get_ratings_version,
+    set_cached_group_recommendations, set_cached_recommendations,
+)
+from .singleflight import SingleFlight
+
+
+class NCFScoreAllTests(SimpleTestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = NCF(500)
+        self.model.eval()
+
+    def test_score_all_matches_forward(self):
+        movie_ids = torch.arange(500)
+        with torch.no_grad():
+            projection = self.model.movie_projection()
+            for _ in range(3):
+                user_emb = torch.randn(1, 50)
+                expected = self.model(user_emb.repeat(500, 1), movie_ids)
+                scores = self.model.score_all(user_emb[0], projection)
+                self.assertEqual(scores.shape, (500,))
+                torch.testing.assert_close(scores, expected, rtol=1e-5, atol=1e-5)
+
+    def test_score_all_batches_users(self):
+        users = torch.randn(4, 50)
+        with torch.no_grad():
+            projection = self.model.movie_projection()
+            batched = self.model.score_all(users, projection)
+            single = torch.stack([self.model.score_all(u, projection) for u in users])
+        self.assertEqual(batched.shape, (4, 500))
+        torch.testing.assert_close(batched, single)
+
+
+class QuantizedRecommenderTests(SimpleTestCase):
+    def test_score_drift_against_fp32(self):
+        num_movies = 2000
+        torch.manual_seed(0)
+        fp32_model = NCF(num_movies)
+        int8_model = NCF(num_movies)
+        int8_model.load_state_dict(fp32_model.state_dict())
+        fp32_model.eval()
+        int8_model.eval()
+        fp32 = Recommender(fp32_model, np.arange(num_movies))
+        int8 = Recommender(int8_model, np.arange(num_movies), quantize=True)
+
+        max_drift, overlap = 0.0, 0.0
+        for _ in range(5):
+            user_emb = torch.randn(50)
+            expected, scores = fp32.score(user_emb), int8.score(user_emb)
+            max_drift = max(max_drift, (scores - expected).abs().max().item())
+            top_fp32 = set(fp32.top_k(expected, [], 50))
+            overlap += len(top_fp32 & set(int8.top_k(scores, [], 50))) / 50 / 5
+        print(f"\nint8 score drift vs fp32: max abs {max_drift:.4f}, top-50 overlap {overlap:.0%}")
+
+        self.assertEqual(int8.movie_projection.dtype, torch.float16)
+        self.assertLess(max_drift, 0.05)
+        self.assertGreater(overlap, 0.8)
+
+
+class ContentRecommenderTests(SimpleTestCase):
+    def setUp(self):
+        # Movies 1-3 are sci-fi, 4-5 are comedies; movie 6 has no features
+        self.recommender = ContentRecommender.from_pairs([1, 2, 3, 4, 5, 6], {
+            "genres": ([1, 2, 3, 4, 5], [10, 10, 10, 20, 20]),
+            "keywords": ([1, 2, 4], [7, 7, 8]),
+        })
+
+    def test_rows_are_l2_normalised(self):
+        norms = np.sqrt(self.recommender.matrix.multiply(self.recommender.matrix).sum(axis=1)).A1
+        np.testing.assert_allclose(norms, [1, 1, 1, 1, 1, 0], rtol=1e-6)
+
+    def test_recommends_similar_unrated_movies(self):
+        self.assertEqual(self.recommender.recommend({1: 5.0}, top_n=2), [2, 3])
+
+    def test_recommends_from_genre_preferences(self):
+        self.assertEqual(sorted(self.recommender.recommend(genre_ids=[20], top_n=5)), [4, 5])
+
+    def test_unknown_user_gets_nothing(self):
+        self.assertEqual(self.recommender.recommend({99: 5.0}), [])
+
+
+class NeighbourIndexTests(SimpleTestCase):
+    def test_blockwise_neighbours_match_brute_force(self):
+        rng = np.random.default_rng(0)
+        embeddings = rng.standard_normal((300, 16)).astype(np.float32)
+        with mock.patch.object(ml_model_train, "NEIGHBOUR_BLOCK_BYTES", 300 * 4 * 7):  # blocks of 7 rows
+            neighbours, scores = compute_neighbours(embeddings, k=5)
+
+        unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        sims = unit @ unit.T
+        np.fill_diagonal(sims, -np.inf)
+        expected = np.argsort(-sims, axis=1)[:, :5]
+        self.assertEqual((neighbours.dtype, scores.dtype), (np.int32, np.float16))
+        np.testing.assert_array_equal(neighbours, expected)
+        np.testing.assert_allclose(scores, np.take_along_axis(sims, expected, axis=1), atol=1e-3)
+
+    def test_similar_reads_the_index(self):
+        torch.manual_seed(0)
+        model = NCF(100)
+        model.eval()
+        recommender = Recommender(model, np.arange(100) * 2)
+        scanned = recommender.similar(10, 5)
+        recommender.neighbours, recommender.neighbour_scores = compute_neighbours(
+            model.movie_embedding.weight.detach().numpy(), 5
+        )
+        indexed = recommender.similar(10, 5)
+        self.assertEqual([m for m, _ in indexed], [m for m, _ in scanned])
+        self.assertNotIn(10, [m for m, _ in indexed])
+        self.assertEqual(recommender.similar(11, 5), [])
+
+    def test_single_movie_has_no_neighbours(self):
+        neighbours, scores = compute_neighbours(np.ones((1, 4), dtype=np.float32), k=5)
+        self.assertEqual(neighbours.shape, (1, 0))
+        self.assertEqual(scores.shape, (1, 0))
+
+
+class RatingsStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = RatingsStore(os.path.join(tmp.name, "ratings"))
+        self.store.write_segment({
+            "userId": [1, 1, 2],
+            "movieId": [10, 20, 10],
+            "rating": [4.0, 3.0, 5.0],
+            "timestamp": [100, 100, 100],
+        })
+
+    def test_single_segment_loads_memory_mapped(self):
+        ratings = self.store.load()
+        self.assertIsInstance(ratings["movieId"], np.memmap)
+        self.assertEqual(ratings["movieId"].dtype, np.int32)
+        self.assertEqual(ratings["timestamp"].dtype, np.int64)
+
+    def test_compaction_keeps_latest_rating(self):
+        self.store.append(1, 20, 5.0, 200)
+        self.store.append(1, 20, 1.0, 300)
+        self.store.append(2, 10, None, 300)  # deleted
+        self.store.append(3, 30, 2.0, 300)
+        self.assertEqual(len(self.store.load()["rating"]), 6)  # tombstones are not ratings
+
+        self.assertEqual(self.store.compact(), 3)
+        ratings = self.store.load()
+        rows = sorted(zip(ratings["userId"].tolist(), ratings["movieId"].tolist(), ratings["rating"].tolist()))
+        self.assertEqual(rows, [(1, 10, 4.0), (1, 20, 1.0), (3, 30, 2.0)])
+        self.assertFalse(os.path.exists(os.path.join(self.store.path, LOG_FILE)))
+
+    def test_compaction_keeps_newest_timestamp_over_arrival_order(self):
+        self.store.append(1, 20, 5.0, 300)
+        self.store.append(1, 20, 1.0, 200)  # older rating, appended late
+        self.store.compact()
+        ratings = self.store.load()
+        rows = sorted(zip(ratings["userId"].tolist(), ratings["movieId"].tolist(), ratings["rating"].tolist()))
+        self.assertEqual(rows, [(1, 10, 4.0), (1, 20, 5.0), (2, 10, 5.0)])
+
+    def test_chunked_compaction_matches_a_single_pass(self):
+        rng = np.random.default_rng(0)
+        for _ in range(300):
+            user, movie = int(rng.integers(-20, 20)), int(rng.integers(1, 8))
+            rating = None if rng.random() < 0.1 else float(rng.integers(1, 6))
+            self.store.append(user, movie, rating, int(rng.integers(0, 1000)))
+        single = RatingsStore(os.path.join(os.path.dirname(self.store.path), "single"))
+        shutil.copytree(self.store.path, single.path)
+
+        kept = self.store.compact(chunk_rows=16)
+        self.assertEqual(single.compact(), kept)
+        self.assertGreater(len(self.store.segments()), 1)
+        chunked, expected = pd.DataFrame(self.store.load()), pd.DataFrame(single.load())
+        pd.testing.assert_frame_equal(chunked.sort_values(["userId", "movieId"], ignore_index=True),
+                                      expected.sort_values(["userId", "movieId"], ignore_index=True))
+
+    def test_columns_chain_segments_and_log_without_concatenating(self):
+        self.store.write_segment({"userId": [4], "movieId": [40], "rating": [1.0], "timestamp": [100]})
+        self.store.append(5, 50, 2.0, 200)
+        self.store.append(5, 60, None, 200)  # tombstones are not ratings
+        columns = self.store.columns()
+        movies = np.concatenate(columns["movieId"].parts)
+        np.testing.assert_array_equal(movies, [10, 20, 10, 40, 50])
+        for start, stop in [(0, 5), (1, 4), (2, 3), (3, 5), (4, 4), (0, 100)]:
+            np.testing.assert_array_equal(columns["movieId"][start:stop], movies[start:stop])
+        self.assertEqual([len(chunk) for chunk in columns["rating"].chunks(2)], [2, 2, 1])
+
+    def test_truncated_log_record_is_ignored(self):
+        self.store.append(3, 30, 2.0)
+        with open(os.path.join(self.store.path, LOG_FILE), "ab") as f:
+            f.write(b"\x01\x02")
+        self.assertEqual(len(self.store.load()["rating"]), 4)
+
+
+class ShardedBatchLoaderTests(SimpleTestCase):
+    def test_epoch_yields_every_rating_once_in_full_batches(self):
+        rng = np.random.default_rng(0)
+        movies = rng.integers(1, 50, 1000).astype(np.int32) * 3
+        ratings = np.arange(1000, dtype=np.float32)  # doubles as the sample id
+        movie_ids = movie_vocabulary(movies, chunk_size=128)
+        np.testing.assert_array_equal(movie_ids, np.unique(movies))
+
+        loader = ShardedBatchLoader(movies, ratings, movie_ids, batch_size=64, shard_size=200, block_size=50)
+        for _ in range(2):
+            batches = list(loader)
+            self.assertEqual(len(batches), len(loader))
+            self.assertTrue(all(len(r) == 64 for _, r in batches[:-1]))
+            rows = torch.cat([m for m, _ in batches]).numpy()
+            seen = torch.cat([r for _, r in batches]).numpy().astype(np.int64)
+            self.assertEqual(sorted(seen.tolist()), list(range(1000)))
+            np.testing.assert_array_equal(movie_ids[rows], movies[seen])
+            self.assertFalse(np.array_equal(seen, np.arange(1000)))  # shuffled
+
+
+class GrowMovieEmbeddingTests(SimpleTestCase):
+    def test_existing_rows_follow_their_movie_ids(self):
+        torch.manual_seed(0)
+        model = NCF(3, embedding_dim=4)
+        movie_ids = np.array([10, 20, 30], dtype=np.int32)
+        old = model.movie_embedding.weight.detach().clone()
+
+        vocabulary = grow_movie_embedding(model, movie_ids, np.array([5, 20, 25]))
+
+        np.testing.assert_array_equal(vocabulary, [5, 10, 20, 25, 30])
+        weight = model.movie_embedding.weight.detach()
+        self.assertEqual(weight.shape, (5, 4))
+        torch.testing.assert_close(weight[[1, 2, 4]], old)
+        self.assertTrue(model.movie_embedding.weight.requires_grad)
+
+
+class HoldoutSplitTests(SimpleTestCase):
+    def test_holds_out_a_fraction_of_each_active_user(self):
+        users = np.array([1] * 10 + [2] * 3 + [3] * 5, dtype=np.int32)
+        train, test = holdout_split({"userId": users}, test_fraction=0.2, min_ratings=5)
+
+        self.assertFalse((train & test).any())
+        self.assertTrue((train | test).all())
+        self.assertEqual(test[users == 1].sum(), 2)
+        self.assertEqual(test[users == 2].sum(), 0)  # too few ratings to hold any out
+        self.assertEqual(test[users == 3].sum(), 1)
+
+
+class BuildReportTests(SimpleTestCase):
+    @override_settings(RECOMMENDER_QUANTIZE=True)
+    def test_latency_is_measured_with_the_reported_quantization(self):
+        with mock.patch.object(evaluation, "benchmark_latency", return_value={}) as benchmark:
+            report = evaluation.build_report(catalog_sizes=(100,))
+        self.assertTrue(report["quantized"])
+        benchmark.assert_called_once_with(100, quantize=True)
+        quantized = synthetic_recommender(100, embedding_dim=4, quantize=True)
+        self.assertEqual(quantized.movie_projection.dtype, torch.float16)
+
+
+class CatalogPreprocessTests(SimpleTestCase):
+    def write_sources(self, path, tmdb_rows):
+        with open(os.path.join(path, "tmdbmovies.csv"), "w") as f:
+            f.write("id,title,release_date,runtime,adult,poster_path,genres,unused\n" + tmdb_rows)
+        with open(os.path.join(path, "movies.csv"), "w") as f:
+            f.write("movieId,title,genres\n1,A,x\n2,B,x\n3,C,x\n")
+        with open(os.path.join(path, "links.csv"), "w") as f:
+            f.write("movieId,imdbId,tmdbId\n1,114709,10\n2,113497,20\n3,113228,\n")
+
+    def test_parses_joins_and_caches_the_sources(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.write_sources(tmp, '10,A,1995-10-30,81.4,False,/a.jpg," Drama, Comedy,"\n'
+                                    '20,B,bad,,True,,,\n'
+                                    '30,C,1995-12-15,90,False,,Drama,\n')
+            catalog = catalog_preprocess.load_catalog(workers=1, chunksize=2, dataset_dir=tmp)
+
+            movies = catalog["movies"].set_index("tmdb_id")
+            self.assertEqual(sorted(movies.index), [10, 20])  # 30 has no MovieLens link
+            self.assertEqual(movies.loc[10, "movieId"], 1)
+            self.assertEqual(movies.loc[10, "imdb_id"], "tt0114709")
+            self.assertEqual(str(movies.loc[10, "release_date"].date()), "1995-10-30")
+            self.assertTrue(pd.isna(movies.loc[20, "release_date"]))
+            self.assertEqual(movies.loc[10, "runtime"], 81)
+            self.assertTrue(movies.loc[20, "adult"])
+            self.assertEqual(movies.loc[10, "poster_path"], "https://image.tmdb.org/t/p/original/a.jpg")
+            self.assertEqual(sorted(catalog["genres"]["name"]), ["Comedy", "Drama"])
+            self.assertNotIn("unused", catalog["movies"])
+
+            with mock.patch.object(catalog_preprocess, "build_catalog") as build:
+                catalog_preprocess.load_catalog(dataset_dir=tmp)
+            build.assert_not_called()
+
+
+class ExportFilteredRatingsTests(TestCase):
+    def test_export_leaves_the_training_store_alone(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source = RatingsStore(os.path.join(tmp.name, "movielens"))
+        exported = RatingsStore(os.path.join(tmp.name, "filtered_small"))
+        training = RatingsStore(os.path.join(tmp.name, "filtered"))
+        source.write_segment({"userId": [1, 2], "movieId": [10, 20], "rating": [4.0, 3.0], "timestamp": [100, 100]})
+        Movie.objects.create(tmdb_id=1, movieId=10, title="A")
+        training.append(-5, 10, 4.0, 200)
+
+        with mock.patch.object(helpers, "movielens_ratings_store", return_value=source), \
+                mock.patch.object(helpers, "exported_ratings_store", return_value=exported), \
+                mock.patch.object(helpers, "filtered_ratings_store", return_value=training):
+            helpers.export_filtered_ratings()
+
+        ratings = exported.load()
+        self.assertEqual(list(zip(ratings["userId"].tolist(), ratings["movieId"].tolist())), [(1, 10)])
+        self.assertEqual(training.segments(), [])
+        self.assertEqual(training.load()["userId"].tolist(), [-5])
+
+
+class TrainModelTests(SimpleTestCase):
+    def test_first_run_imports_the_csv_and_trains_on_compacted_ratings(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.makedirs(os.path.join(tmp.name, "movielens_dataset"))
+        pd.DataFrame({"userId": [1, 2, 3], "movieId": [10, 20, 30], "rating": [4.0, 3.0, 5.0],
+                      "timestamp": [100, 100, 100]}).to_csv(
+            os.path.join(tmp.name, "movielens_dataset", "filtered_ratings.csv"), index=False)
+        store = RatingsStore(os.path.join(tmp.name, "filtered"))
+        store.append(-5, 10, 4.0, 200)
+        store.append(-5, 10, 2.0, 300)  # re-rated
+        store.append(1, 10, None, 300)  # deleted
+
+        with override_settings(BASE_DIR=tmp.name), \
+                mock.patch.object(ml_model_train, "filtered_ratings_store", return_value=store), \
+                mock.patch.object(ml_model_train, "fit_ratings") as fit, \
+                mock.patch.object(ml_model_train, "publish_model") as publish:
+            ml_model_train.train_model(workers=1)
+
+        np.testing.assert_array_equal(fit.call_args.args[1], [10, 20, 30])
+        # Trained on the compacted store: the CSV's 3 ratings less the deleted one, plus the re-rated one
+        self.assertEqual(publish.call_args.args[2], 3)
+        ratings = store.load()
+        self.assertEqual(sorted(zip(ratings["userId"].tolist(), ratings["rating"].tolist())),
+                         [(-5, 2.0), (2, 3.0), (3, 5.0)])
+
+
+class SyncDatabaseTests(TestCase):
+    def catalog(self, rows):
+        tmdb = pd.DataFrame(rows, columns=["id", "movieId", "title", "popularity", "genres"])
+        links = pd.DataFrame({"movieId": tmdb["movieId"], "imdbId": pd.array([None] * len(tmdb), dtype="Int64"),
+                              "tmdbId": tmdb["id"]})
+        tmdb = tmdb.drop(columns="movieId").astype({"title": "string", "genres": "string"})
+        catalog_preprocess._init_worker(links)
+        return catalog_preprocess._join([catalog_preprocess._parse_tmdb_chunk(tmdb)])
+
+    def sync(self, rows):
+        with mock.patch.object(helpers, "load_catalog", return_value=self.catalog(rows)):
+            return helpers.sync_database()
+
+    def test_only_changes_are_written_and_removed_movies_retired(self):
+        self.sync([(1, 10, "A", 1.0, "Drama, Comedy"), (2, 20, "B", 2.0, "Drama"), (3, 30, "C", 3.0, None)])
+        user = get_user_model().objects.create(email="a@b.c", name="a")
+        Rating.objects.create(user=user, movie=Movie.objects.get(tmdb_id=3), rating=4)
+        untouched = Movie.objects.get(tmdb_id=1)
+
+        counts = self.sync([(1, 10, "A", 1.0, "Drama, Comedy"), (2, 20, "B2", 2.0, "Horror"), (4, 40, "D", 4.0, None)])
+
+        self.assertEqual(counts, {"added": 1, "changed": 1, "retired": 1, "unchanged": 1})
+        self.assertEqual(Movie.objects.get(tmdb_id=1).source_hash, untouched.source_hash)
+        changed = Movie.objects.get(tmdb_id=2)
+        self.assertEqual(changed.title, "B2")
+        self.assertEqual([g.name for g in changed.genres.all()], ["Horror"])
+        self.assertEqual(sorted(g.name for g in untouched.genres.all()), ["Comedy", "Drama"])
+        # The retired movie keeps its rating but leaves the active catalog
+        self.assertIsNotNone(Movie.objects.get(tmdb_id=3).retired_at)
+        self.assertEqual(Rating.objects.count(), 1)
+        self.assertEqual(sorted(Movie.objects.active().values_list("tmdb_id", flat=True)), [1, 2, 4])
+
+        counts = self.sync([(1, 10, "A", 1.0, "Drama, Comedy"), (2, 20, "B2", 2.0, "Horror"), (3, 30, "C", 3.0, None)])
+        self.assertEqual(counts, {"added": 0, "changed": 1, "retired": 1, "unchanged": 2})
+        self.assertIsNone(Movie.objects.get(tmdb_id=3).retired_at)
+
+    def test_catalog_version_changes_only_when_the_catalog_does(self):
+        rows = [(1, 10, "A", 1.0, "Drama"), (2, 20, "B", 2.0, None)]
+        self.sync(rows)
+        version = Movie.objects.version()
+
+        self.sync(rows)
+        self.assertEqual(Movie.objects.version(), version)
+        self.sync(rows[:1])  # only retires a movie
+        self.assertNotEqual(Movie.objects.version(), version)
+        version = Movie.objects.version()
+        self.sync([(1, 10, "A", 1.0, "Comedy")])
+        self.assertNotEqual(Movie.objects.version(), version)
+
+
+class RatingsVersionTests(TestCase):
+    def test_changes_on_every_rating_write(self):
+        user = get_user_model().objects.create(email="a@b.c", name="a")
+        movies = [Movie.objects.create(tmdb_id=i, title=str(i)) for i in range(2)]
+        versions = [get_ratings_version(user.id)]
+
+        rating = Rating.objects.create(user=user, movie=movies[0], rating=3)
+        versions.append(get_ratings_version(user.id))
+        Rating.objects.create(user=user, movie=movies[1], rating=4)
+        versions.append(get_ratings_version(user.id))
+        rating.rating = 5
+        rating.save()
+        versions.append(get_ratings_version(user.id))
+        rating.delete()
+        versions.append(get_ratings_version(user.id))
+
+        self.assertEqual(len(set(versions)), len(versions))
+        self.assertEqual(get_ratings_version(user.id), versions[-1])
+        self.assertNotEqual(get_group_version(1, [user.id]), get_group_version(1, [user.id, user.id + 1]))
+
+    def test_cached_lists_are_keyed_by_model_version(self):
+        set_cached_recommendations(1, "3-100", "v1", [10, 20])
+        set_cached_group_recommendations(1, "average", "abc", "v1", [30])
+        self.assertEqual(get_cached_recommendations(1, "3-100", "v1"), [10, 20])
+        self.assertIsNone(get_cached_recommendations(1, "3-100", "v2"))
+        self.assertEqual(get_cached_group_recommendations(1, "average", "abc", "v1"), [30])
+        self.assertIsNone(get_cached_group_recommendations(1, "average", "abc", "v2"))
+
+
+class UserTasteTests(TestCase):
+    def setUp(self):
+        self.recommender = synthetic_recommender(20, embedding_dim=4)
+        patcher = mock.patch("movies.ml_model.get_recommender", return_value=self.recommender)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create(email="a@b.c", name="a")
+        self.movies = [Movie.objects.create(tmdb_id=i, movieId=i, title=str(i)) for i in range(1, 6)]
+
+    def assertTasteIsExact(self):
+        taste = UserTaste.objects.get(user=self.user)
+        ratings = dict(Rating.objects.filter(user=self.user).values_list("movie__movieId", "rating"))
+        embedding_sum, count = self.recommender.taste_sum(ratings)
+        self.assertEqual(taste.rating_count, count)
+        np.testing.assert_allclose(np.frombuffer(taste.embedding_sum), embedding_sum, atol=1e-5)
+
+    def test_rating_writes_update_the_vector_incrementally(self):
+        Rating.objects.create(user=self.user, movie=self.movies[0], rating=4)
+        user_taste.get_user_embedding(self.user.id)
+        with mock.patch.object(user_taste, "rebuild_user_taste") as rebuild:
+            rating = Rating.objects.create(user=self.user, movie=self.movies[1], rating=2)
+            rating.rating = 5
+            rating.save()
+            rating.delete()
+        rebuild.assert_not_called()
+        self.assertTasteIsExact()
+
+    def test_write_already_read_by_a_rebuild_is_not_applied_twice(self):
+        user_taste.rebuild_user_taste(self.user.id)
+        # Committed, then rebuilt before its post_save handler ran
+        Rating.objects.bulk_create([Rating(user=self.user, movie=self.movies[0], rating=4)])
+        user_taste.rebuild_user_taste(self.user.id)
+        user_taste.apply_rating_change(self.user.id, self.movies[0].pk, 1, new_rating=4)
+        self.assertTasteIsExact()
+
+    def test_interleaved_writes_trigger_a_rebuild(self):
+        user_taste.rebuild_user_taste(self.user.id)
+        Rating.objects.bulk_create([Rating(user=self.user, movie=self.movies[0], rating=4),
+                                    Rating(user=self.user, movie=self.movies[1], rating=3)])
+        user_taste.apply_rating_change(self.user.id, self.movies[0].pk, 1, new_rating=4)
+        self.assertTasteIsExact()
+        user_taste.apply_rating_change(self.user.id, self.movies[1].pk, 2, new_rating=3)
+        self.assertTasteIsExact()
+
+
+class GroupRecommendationViewTests(TestCase):
+    async def test_group_without_known_ratings_gets_popular_movies(self):
+        from groupchat.models import Group
+
+        admin = await get_user_model().objects.acreate(email="a@b.c", name="a")
+        group = await Group.objects.acreate(name="g", admin=admin)
+        movie = await Movie.objects.acreate(tmdb_id=1, movieId=10, title="A")
+        await Rating.objects.acreate(user=admin, movie=movie, rating=4)
+
+        with mock.patch.object(views, "authenticate", return_value=admin), \
+                mock.patch.object(views, "get_recommender", return_value=mock.Mock(version="v1")), \
+                mock.patch.object(views, "recommend_for_group", side_effect=ValueError), \
+                mock.patch.object(views, "sample_fallback", return_value=[{"title": "popular"}]):
+            response = await AsyncClient().post("/movies/grouprecomendations/", {"group_id": group.id},
+                                                content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"title": "popular"}])
+
+
+class SimilarMoviesViewTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(email="a@b.c", name="a")
+        self.movie = Movie.objects.create(tmdb_id=1, movieId=10, title="A")
+
+    def test_negative_limit_is_rejected(self):
+        request = APIRequestFactory().get("/movies/similar/", {"movie_id": self.movie.id, "limit": -3})
+        force_authenticate(request, user=self.user)
+        with mock.patch.object(views, "get_recommender") as get_recommender:
+            response = views.SimilarMoviesView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        get_recommender.assert_not_called()
+
+
+class BatchSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.recommender = synthetic_recommender(40, embedding_dim=4)
+        rng = np.random.default_rng(0)
+        self.requests = [(rng.standard_normal(4).astype(np.float32), rng.choice(self.recommender.movie_ids, 3), 5)
+                         for _ in range(3)]
+
+    def run_batch(self, max_batch_size, max_wait_ms):
+        scheduler = BatchScheduler(max_batch_size, max_wait_ms, recommender_getter=lambda: self.recommender)
+        with mock.patch.object(self.recommender, "score_batch", wraps=self.recommender.score_batch) as score_batch:
+            start = time.monotonic()
+            futures = [scheduler.submit(*request) for request in self.requests]
+            results = [future.result(timeout=5) for future in futures]
+            elapsed = time.monotonic() - start
+        self.assertEqual(results, [self.recommender.recommend_for_embedding(*request) for request in self.requests])
+        self.assertEqual(score_batch.call_count, 1)
+        return elapsed
+
+    def test_full_batch_is_scored_without_waiting(self):
+        self.assertLess(self.run_batch(max_batch_size=3, max_wait_ms=10_000), 5)
+
+    def test_partial_batch_is_scored_after_the_wait(self):
+        self.assertGreaterEqual(self.run_batch(max_batch_size=10, max_wait_ms=200), 0.2)
+
+    def test_cancelled_request_does_not_fail_the_batch(self):
+        scheduler = BatchScheduler(3, 10_000, recommender_getter=lambda: self.recommender)
+        futures = [scheduler.submit(*request) for request in self.requests[:2]]
+        futures[0].cancel()
+        futures.append(scheduler.submit(*self.requests[2]))
+        self.assertEqual(futures[2].result(timeout=5), self.recommender.recommend_for_embedding(*self.requests[2]))
+        self.assertEqual(futures[1].result(timeout=5), self.recommender.recommend_for_embedding(*self.requests[1]))
+
+
+class GroupRecommenderTests(SimpleTestCase):
+    def test_strategies_aggregate_every_member_on_every_movie(self):
+        recommender = synthetic_recommender(60, embedding_dim=8)
+        rng = np.random.default_rng(0)
+        group_ratings = [(user, int(movie_id), float(rng.integers(1, 6)))
+                         for user in range(3) for movie_id in rng.choice(recommender.movie_ids, 4, replace=False)]
+        rated = {movie_id for _, movie_id, _ in group_ratings}
+        member_scores = np.stack([
+            recommender.score(torch.as_tensor(recommender.user_embedding(
+                {movie_id: rating for u, movie_id, rating in group_ratings if u == user}), dtype=torch.float32)
+            ).cpu().numpy()
+            for user in range(3)
+        ])
+        aggregates = {"average": member_scores.mean(0), "least_misery": member_scores.min(0),
+                      "most_pleasure": member_scores.max(0)}
+
+        for strategy, scores in aggregates.items():
+            with self.subTest(strategy=strategy):
+                expected = [int(m) for m in recommender.movie_ids[np.argsort(-scores)] if m not in rated][:5]
+                self.assertEqual(recommend_for_group(group_ratings, strategy, 5, recommender, candidate_pool=0),
+                                 expected)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_waiters_share_the_leader_result(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def main():
+            flight = SingleFlight()
+            return await asyncio.gather(*(flight.run("key", compute) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), ["result"] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_waiters_receive_the_leader_exception(self):
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def main():
+            flight = SingleFlight()
+            results = await asyncio.gather(flight.run("key", compute), flight.run("key", compute),
+                                           return_exceptions=True)
+            return results, flight._calls
+
+        results, calls = asyncio.run(main())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(calls, {})
+
+    def test_waiter_runs_fn_when_the_leader_is_cancelled(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def main():
+            flight = SingleFlight()
+            leader = asyncio.create_task(flight.run("key", compute))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(flight.run("key", compute))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await asyncio.wait_for(waiter, 1), flight._calls
+
+        result, pending = asyncio.run(main())
+        self.assertEqual(result, "result")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(pending, {})
+
+    def test_cancelled_waiter_leaves_the_leader_running(self):
+        async def compute():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def main():
+            flight = SingleFlight()
+            leader = asyncio.create_task(flight.run("key", compute))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(flight.run("key", compute))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            return await leader
+
+        self.assertEqual(asyncio.run(main()), "result")
+
+
+class PrecomputedRecommendationsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(email="a@b.c", name="a")
+        movies = [Movie.objects.create(tmdb_id=i, movieId=i, title=str(i)) for i in range(3)]
+        self.ratings = [Rating.objects.create(user=self.user, movie=movie, rating=4) for movie in movies[:2]]
+
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        np.save(os.path.join(snapshot_dir.name, "table.npy"), np.array([[self.user.id, 2, 7, 8, 9]], dtype=np.int32))
+        meta = {"file": "table.npy", "format": precomputed.SNAPSHOT_FORMAT, "created_at": timezone.now().isoformat(),
+                "model_version": "v1", "top_n": 3, "num_users": 1}
+        with open(os.path.join(snapshot_dir.name, precomputed.SNAPSHOT_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        for patch in (mock.patch.object(precomputed, "SNAPSHOT_DIR", snapshot_dir.name),
+                      mock.patch("movies.ml_model.get_recommender", return_value=mock.Mock(version="v1"))):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_serves_the_snapshot_until_the_ratings_change(self):
+        self.assertEqual(precomputed.get_precomputed_recommendations(self.user.id, 2), [7, 8])
+        self.ratings[0].delete()
+        self.assertIsNone(precomputed.get_precomputed_recommendations(self.user.id, 2))
+
+    def test_new_rating_makes_the_snapshot_stale(self):
+        Rating.objects.create(user=self.user, movie=Movie.objects.get(tmdb_id=2), rating=5)
+        self.assertIsNone(precomputed.get_precomputed_recommendations(self.user.id, 2))
+
+    def test_snapshot_shorter_than_the_candidates_is_not_used(self):
+        self.assertIsNone(precomputed.get_precomputed_recommendations(self.user.id, 50))
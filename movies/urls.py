@@ -11,5 +11,6 @@ urlpatterns = [
     path('genres/', GetAllGenresView.as_view(), name='genres'),
     path('getmovie/', AllMovieDetailsView.as_view(), name='getmovie'),
     path('grouprecomendations/', GroupRecommendation.as_view(), name='grouprecomendations'),
+    path('similar/', SimilarMoviesView.as_view(), name='similar'),
 
 ]
\ No newline at end of file
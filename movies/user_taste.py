@@ -0,0 +1,116 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Sum
+
+from users.models import CustomUser
+from .models import Rating, UserTaste
+
+
+def _lock_user(user_id):
+    """
+    Serialise the rebuilds and incremental updates of one user's taste vector.
+    Must be called inside a transaction.
+    """
+    CustomUser.objects.select_for_update().filter(pk=user_id).exists()
+
+
+def _checksum(count, total, weighted):
+    return repr((int(count or 0), float(total or 0), float(weighted or 0)))
+
+
+def _rating_totals(user_id):
+    """
+    Count, sum and movie-weighted sum of a user's MovieLens-movie ratings, so
+    a taste vector can tell which rating writes it already includes.
+    """
+    totals = Rating.objects.filter(user_id=user_id, movie__movieId__isnull=False).aggregate(
+        count=Count('id'), total=Sum('rating'),
+        weighted=Sum(F('rating') * F('movie_id'), output_field=FloatField()),
+    )
+    return totals['count'] or 0, totals['total'] or 0, totals['weighted'] or 0
+
+
+def rebuild_user_taste(user_id, recommender=None):
+    """
+    Recompute a user's taste vector from all of their ratings.
+    """
+    from .ml_model import get_recommender
+
+    recommender = recommender or get_recommender()
+    with transaction.atomic():
+        _lock_user(user_id)
+        rows = list(Rating.objects.filter(user_id=user_id, movie__movieId__isnull=False)
+                                  .values_list('movie_id', 'movie__movieId', 'rating'))
+        user_ratings = {int(movie_id): rating for _, movie_id, rating in rows}
+        embedding_sum, count = recommender.taste_sum(user_ratings)
+        taste, _ = UserTaste.objects.update_or_create(
+            user_id=user_id,
+            defaults={
+                'embedding_sum': np.asarray(embedding_sum, dtype=np.float64).tobytes(),
+                'rating_count': count,
+                'model_version': recommender.version,
+                'ratings_checksum': _checksum(len(rows), sum(r for _, _, r in rows),
+                                              sum(r * pk for pk, _, r in rows)),
+            },
+        )
+    return taste
+
+
+def get_user_embedding(user_id, recommender=None):
+    """
+    Return the user embedding (mean of the rating-weighted movie embeddings).
+    The stored vector is rebuilt when it is missing or was built with other weights.
+    """
+    from .ml_model import get_recommender
+
+    recommender = recommender or get_recommender()
+    taste = UserTaste.objects.filter(user_id=user_id).first()
+    if taste is None or taste.model_version != recommender.version:
+        taste = rebuild_user_taste(user_id, recommender)
+    if not taste.rating_count:
+        raise ValueError("No valid rated movies found in dataset.")
+    return np.frombuffer(taste.embedding_sum, dtype=np.float64) / taste.rating_count
+
+
+def apply_rating_change(user_id, movie_pk, movie_id, old_rating=None, new_rating=None):
+    """
+    Update a stored taste vector in O(embedding_dim) after a committed rating
+    was added (old_rating is None), changed, or deleted (new_rating is None).
+    Missing or stale vectors are left alone; they are rebuilt on the next read.
+
+    The signal runs after the write is committed, so a concurrent rebuild may
+    already include it. The stored ratings checksum tells: the vector is
+    patched only when it is exactly this change behind, and rebuilt when
+    other writes interleaved.
+    """
+    # Imported here: the rating signals load this module in every process,
+    # which should not all import torch
+    from .ml_model import get_recommender
+
+    if movie_id is None or old_rating == new_rating:
+        return
+    delta = (new_rating or 0) - (old_rating or 0)
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    with transaction.atomic():
+        _lock_user(user_id)
+        taste = UserTaste.objects.filter(user_id=user_id).first()
+        if taste is None:
+            return
+        recommender = get_recommender()
+        if taste.model_version != recommender.version:
+            return
+        count, total, weighted = _rating_totals(user_id)
+        current = _checksum(count, total, weighted)
+        if taste.ratings_checksum == current:
+            return  # a rebuild already read this write
+        before = _checksum(count - count_delta, total - delta, weighted - delta * movie_pk)
+        if taste.ratings_checksum != before:
+            rebuild_user_taste(user_id, recommender)
+            return
+        rows, known = recommender.rows_for([movie_id])
+        if known[0]:
+            embedding_sum = np.frombuffer(taste.embedding_sum, dtype=np.float64)
+            taste.embedding_sum = (embedding_sum + delta * recommender.movie_vectors(rows)[0]).tobytes()
+            taste.rating_count += count_delta
+        taste.ratings_checksum = current
+        taste.save(update_fields=['embedding_sum', 'rating_count', 'ratings_checksum', 'updated_at'])
@@ -1,61 +1,132 @@
+import json
 import random
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.views import View
 from rest_framework import permissions, status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from groupchat.models import Group
-from movies.ml_model import recommend_movies
 from movies.models import *
 from users.models import CustomUser
-from .helpers import write_rating_to_csv
+from .batching import arecommend_for_embedding, run_inference
+from .content_recommender import get_content_recommender
+from .fallback_pool import sample_fallback
+from .group_recommender import AGGREGATION_STRATEGIES, recommend_for_group
+from .ml_model import get_recommender
+from .precomputed import get_precomputed_recommendations
+from .recommendation_cache import (
+    get_ratings_version, get_cached_recommendations, set_cached_recommendations,
+    get_group_version, get_cached_group_recommendations, set_cached_group_recommendations,
+)
 from .serializers import *
+from .singleflight import SingleFlight
+from .user_taste import get_user_embedding
 
 
 # Create your views here.
 
-class Recommendation(APIView):
-    permission_classes = (permissions.IsAuthenticated,)
-
-    def get(self, request):
-        user = request.user
-        ratings = Rating.objects.filter(user=user)
+async def authenticate(request):
+    """
+    JWT authentication for the async views, which do not go through DRF.
+    """
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def request_data(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except json.JSONDecodeError:
+        return request.POST
+
+
+def serialize_movies(movie_ids):
+    movies = Movie.objects.active().filter(movieId__in=movie_ids)
+    return MovieSerializer(movies, many=True).data
+
+
+def serialize_movie_pks(movie_pks):
+    movies = Movie.objects.active().filter(pk__in=movie_pks).prefetch_related('genres')
+    return MovieSerializer(movies, many=True).data
+
+
+async def content_recommendations(user_ratings_dict, genre_name=None, top_n=5):
+    """
+    Content-based picks for a few {movie pk: rating} and an optional genre,
+    falling back to the popular movies when nothing matches. Only the scoring
+    runs on the inference executor; the queries go through sync_to_async,
+    which manages the database connection of its thread.
+    """
+    genre_ids = []
+    if genre_name:
+        genre_ids = [genre_id async for genre_id in Genre.objects.filter(name=genre_name).values_list('id', flat=True)]
+    recommender = await sync_to_async(get_content_recommender)()  # built from the catalog on first use
+    movie_pks = await run_inference(recommender.recommend, user_ratings_dict, genre_ids, 50)
+    if not movie_pks:
+        return await sync_to_async(sample_fallback)(top_n, genre_name)
+    return await sync_to_async(serialize_movie_pks)(random.sample(movie_pks, min(top_n, len(movie_pks))))
+
+
+class Recommendation(View):
+    """
+    Async so the model scoring runs on the inference executor and the
+    event loop stays free for the chat traffic served by the same process.
+    """
+
+    async def get(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."},
+                                status=status.HTTP_401_UNAUTHORIZED)
         try:
+            ratings = [
+                rating async for rating in
+                Rating.objects.filter(user=user).values_list('movie_id', 'movie__movieId', 'rating')
+            ]
+            rated_movie_ids = [movie_id for _, movie_id, _ in ratings if movie_id is not None]
+            content_ratings = {pk: rating for pk, _, rating in ratings}
 
             # Case 1: Not enough ratings (less than 3)
-            if ratings.count() < 3:
-                # Get top 50 movies sorted by rating
-                top_movies = list(Movie.objects.order_by('-popularity')[:50])
-
-                # Randomly select 5
-                recommended_movies = random.sample(top_movies, min(5, len(top_movies)))
-
-                # Serialize
-                serializer = MovieSerializer(recommended_movies, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
-
-            # Case 2: Enough ratings, use recommendation model
-            user_ratings = {int(r.movie.movieId): r.rating for r in ratings}
-            recommended_ids = recommend_movies(user_ratings, 50)
+            if len(rated_movie_ids) < 3:
+                if content_ratings:
+                    data = await content_recommendations(content_ratings, request.GET.get('genre'))
+                else:
+                    data = await sync_to_async(sample_fallback)(5, request.GET.get('genre'))
+                return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
+
+            # Case 2: Enough ratings, use recommendation model.
+            # The top 50 is cached until the user rates something again or the model is reloaded.
+            model_version = (await sync_to_async(get_recommender)()).version
+            version = await sync_to_async(get_ratings_version)(user.id)
+            recommended_ids = get_cached_recommendations(user.id, version, model_version)
+            if recommended_ids is None:
+                # Batch-precomputed list first, live scoring if the user rated since
+                recommended_ids = await sync_to_async(get_precomputed_recommendations)(user.id, 50)
+            if recommended_ids is None:
+                user_emb = await sync_to_async(get_user_embedding)(user.id)
+                recommended_ids = await arecommend_for_embedding(user_emb, rated_movie_ids, 50)
+            set_cached_recommendations(user.id, version, model_version, recommended_ids)
 
             recommended_ids_sample = random.sample(recommended_ids, min(5, len(recommended_ids)))
-            #recommended_ids_sample = recommended_ids[:5]
-            movies = Movie.objects.filter(movieId__in=recommended_ids_sample)
-            serializer = MovieSerializer(movies, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            data = await sync_to_async(serialize_movies)(recommended_ids_sample)
+            return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
         except ValueError:
-            top_movies = list(Movie.objects.order_by('-popularity')[:50])
-
-            # Randomly select 5
-            recommended_movies = random.sample(top_movies, min(5, len(top_movies)))
-
-            # Serialize
-            serializer = MovieSerializer(recommended_movies, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # None of the rated movies is known to the model
+            data = await content_recommendations(content_ratings, request.GET.get('genre'))
+            return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
         except Exception as e:
             print(e)
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return HttpResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 
@@ -75,7 +146,7 @@ class SmallPagination(LimitOffsetPagination):
 
 class MovieListView(generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = Movie.objects.all().distinct()  # .distinct() is important for M2M filtering
+    queryset = Movie.objects.active().distinct()  # .distinct() is important for M2M filtering
     serializer_class = MovieSerializer
 
     # --- 1. Filter by M2M Fields (using django-filter) ---
@@ -114,10 +185,8 @@ class AddRatingView(APIView):
             movie = Movie.objects.get(id=movie_id)
             user = request.user
 
-            if Rating.objects.filter(user=user, movie=movie).exists() :
-                Rating.objects.filter(user=user, movie=movie).update(rating=rating)
-            else:
-                Rating.objects.create(user=user, movie=movie, rating=rating)
+            # Saved through the model so the Rating signals fire
+            Rating.objects.update_or_create(user=user, movie=movie, defaults={'rating': rating})
             return Response({'message': 'Rating added successfully'}, status=status.HTTP_201_CREATED)
         except Exception as e:
             print(e)
@@ -185,49 +254,92 @@ class AllMovieDetailsView(APIView):
             return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-
-class GroupRecommendation(APIView):
+class SimilarMoviesView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    def get(self, request):
+        try:
+            movie = Movie.objects.get(id=request.query_params['movie_id'])
+            limit = min(int(request.query_params.get('limit', 10)), settings.SIMILAR_MOVIES_K)
+            if limit < 0:
+                return Response({'message': 'limit must not be negative'}, status=status.HTTP_400_BAD_REQUEST)
+            if movie.movieId is None:
+                return Response([], status=status.HTTP_200_OK)
+            similar = get_recommender().similar(movie.movieId, limit)
+            movies = Movie.objects.active().filter(movieId__in=[movie_id for movie_id, _ in similar]).prefetch_related('genres')
+            by_movie_id = {m.movieId: m for m in movies}
+            data = []
+            for movie_id, similarity in similar:
+                if movie_id in by_movie_id:
+                    movie_data = MovieSerializer(by_movie_id[movie_id]).data
+                    movie_data["similarity"] = similarity
+                    data.append(movie_data)
+            return Response(data, status=status.HTTP_200_OK)
+        except Movie.DoesNotExist:
+            return Response({'message': 'Movie not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    def post(self, request):
-        user = request.user
-        group_id=request.data.get('group_id')
+
+# Members of a group tend to ask for recommendations at the same time
+group_recommendations_flight = SingleFlight()
+
+
+class GroupRecommendation(View):
+
+    async def post(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        data = request_data(request)
+        group_id = data.get('group_id')
+        strategy = data.get('strategy', 'average')
+        if strategy not in AGGREGATION_STRATEGIES:
+            return JsonResponse({"error": f"Unknown strategy, use one of {', '.join(AGGREGATION_STRATEGIES)}"},
+                                status=status.HTTP_400_BAD_REQUEST)
         # --- 1. Verify group and membership ---
         try:
-            group = Group.objects.get(id=group_id)
-        except Group.DoesNotExist:
-            return Response({"error": "Group not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        if user not in group.members.all() and user != group.admin:
-            return Response({"error": "You are not part of this group"}, status=status.HTTP_403_FORBIDDEN)
-
-        # --- 2. Collect all group member ratings ---
-        group_members = list(group.members.all()) + [group.admin]
-        group_ratings = Rating.objects.filter(user__in=group_members)
-
-        if not group_ratings.exists():
-            # No ratings -> fallback to random top-rated movies
-            top_movies = list(Movie.objects.order_by('-rating')[:50])
-            recommended = random.sample(top_movies, min(5, len(top_movies)))
-            serializer = MovieSerializer(recommended, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-
-        # --- 3. Combine ratings (average per movie) ---
-        movie_ratings = {}
-        for rating in group_ratings:
-            movie_id = int(rating.movie.movieId)
-            if movie_id not in movie_ratings:
-                movie_ratings[movie_id] = []
-            movie_ratings[movie_id].append(rating.rating)
-
-        # Average the ratings
-        avg_ratings = {mid: sum(rates)/len(rates) for mid, rates in movie_ratings.items()}
-
-        # --- 4. Pass averaged ratings to recommender ---
-        recommended_ids = recommend_movies(avg_ratings, top_n=5)
+            group = await Group.objects.aget(id=group_id)
+        except (Group.DoesNotExist, ValueError):
+            return JsonResponse({"error": "Group not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not await group.members.filter(id=user.id).aexists() and user.id != group.admin_id:
+            return JsonResponse({"error": "You are not part of this group"}, status=status.HTTP_403_FORBIDDEN)
+
+        # --- 2. Serve from the cache, or compute once for all concurrent requests ---
+        member_ids = [member_id async for member_id in group.members.values_list('id', flat=True)]
+        member_ids.append(group.admin_id)
+        model_version = (await sync_to_async(get_recommender)()).version
+        version = await sync_to_async(get_group_version)(group.id, member_ids)
+        recommended_ids = get_cached_group_recommendations(group.id, strategy, version, model_version)
+
+        async def compute():
+            group_ratings = [
+                rating async for rating in
+                Rating.objects.filter(user_id__in=member_ids, movie__movieId__isnull=False)
+                              .values_list('user_id', 'movie__movieId', 'rating')
+            ]
+            if not group_ratings:
+                return None
+            # Score every member and combine with the chosen strategy
+            try:
+                movie_ids = await run_inference(recommend_for_group, group_ratings, strategy, 5)
+            except ValueError:
+                # None of the members' rated movies is known to the model
+                return None
+            set_cached_group_recommendations(group.id, strategy, version, model_version, movie_ids)
+            return movie_ids
+
+        if recommended_ids is None:
+            recommended_ids = await group_recommendations_flight.run((group.id, strategy, version, model_version),
+                                                                     compute)
+
+        if recommended_ids is None:
+            # No usable ratings -> fallback to random popular movies
+            data = await sync_to_async(sample_fallback)()
+            return JsonResponse(data, safe=False, status=status.HTTP_200_OK)
 
         recommended_ids_sample = random.sample(recommended_ids, min(5, len(recommended_ids)))
-        # --- 5. Fetch and serialize movies ---
-        recommended_movies = Movie.objects.filter(movieId__in=recommended_ids_sample)
-        serializer = MovieSerializer(recommended_movies, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        # --- 3. Fetch and serialize movies ---
+        data = await sync_to_async(serialize_movies)(recommended_ids_sample)
+        return JsonResponse(data, safe=False, status=status.HTTP_200_OK)